@@ -0,0 +1,139 @@
+# bench/fake_api.py
+import asyncio
+import itertools
+import json
+import secrets
+import time
+
+from aiohttp import web
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+# Методы, которые возвращают объект Message
+_MESSAGE_METHODS = {"sendMessage", "sendPhoto", "sendInvoice", "sendDocument", "editMessageText", "editMessageCaption"}
+
+
+class FakeBotAPI:
+    """Локальная замена Telegram Bot API на aiohttp.
+
+    Отвечает правдоподобными объектами на методы, которыми пользуется бот, раздает обновления
+    через getUpdates и запоминает время каждого исходящего вызова по chat_id, чтобы стенд мог
+    измерить задержку «обновление → ответ бота». `latency` имитирует сетевую задержку Telegram.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8081, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls = {}
+        self.invoices = {}
+        self.webhook_set = asyncio.Event()
+        self.polling_started = asyncio.Event()
+        self._updates = []
+        self._updates_changed = asyncio.Event()
+        self._waiters = {}
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def push_update(self, update):
+        """Кладет обновление в очередь getUpdates (режим polling)."""
+        self._updates.append(update)
+        self._updates_changed.set()
+
+    def wait_reply(self, chat_id) -> asyncio.Future:
+        """Future, который завершится при первом исходящем вызове бота в чат `chat_id`."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(int(chat_id), []).append(future)
+        return future
+
+    async def _params(self, request):
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str) and value[:1] in "[{":
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "setWebhook":
+            self.webhook_set.set()
+        if method == "sendInvoice":
+            self.invoices[int(params["chat_id"])] = params["payload"]
+        chat_id = params.get("chat_id")
+        if chat_id is not None and str(chat_id).lstrip("-").isdigit():
+            for future in self._waiters.pop(int(chat_id), []):
+                if not future.done():
+                    future.set_result((method, time.perf_counter()))
+        return self._ok(self._result(method, params))
+
+    async def _get_updates(self, params):
+        self.polling_started.set()
+        offset = int(params.get("offset") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._updates_changed.clear()
+            try:
+                await asyncio.wait_for(self._updates_changed.wait(), timeout=float(params.get("timeout") or 0) or 0.01)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self._updates[:limit]
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method in _MESSAGE_METHODS:
+            chat_id = int(params.get("chat_id") or 0)
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+                "from": BOT_USER,
+                "text": params.get("text") or "",
+            }
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method in ("createChatInviteLink", "editChatInviteLink", "revokeChatInviteLink"):
+            return {
+                "invite_link": params.get("invite_link") or f"https://t.me/+{secrets.token_urlsafe(12)}",
+                "creator": BOT_USER,
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": method == "revokeChatInviteLink",
+                "expire_date": int(params.get("expire_date") or 0) or None,
+                "member_limit": int(params.get("member_limit") or 0) or None,
+            }
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        return True
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({"ok": True, "result": result})
@@ -0,0 +1,294 @@
+# bench/load.py
+"""Синтетическая нагрузка на бота с поддельным Bot API.
+
+Настоящий Dispatcher с user_handlers.router и admin_handlers.router получает сценарные
+потоки обновлений, а все вызовы Bot API уходят на локальный сервер из bench/fake_api.py.
+База создается во временной папке и заполняется заранее.
+
+Сценарии:
+    start      — шквал /start (в основном от уже известных пользователей)
+    funnel     — полная воронка: Оплата → тариф → промокод → счет → pre-checkout → successful_payment
+    broadcast  — рассылка админа по всей базе пользователей
+    expiry     — снятие истекших подписок и кик из канала
+
+Для каждого сценария считаются p50/p95/p99 времени обработки обновления, пропускная
+способность, суммарное время в функциях database.py (складывается по всем одновременным
+вызовам, поэтому может превышать длительность сценария) и число вызовов Bot API.
+Результат пишется в JSON, чтобы прогоны можно было сравнивать:
+
+    python -m bench.load --users 100000 --output bench_results.json
+"""
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("ADMIN_IDS", "1")
+os.environ.setdefault("PAYMENT_PROVIDER_TOKEN", "bench")
+os.environ.setdefault("OUTBOX_RATE", "100000")
+os.environ.setdefault("BROADCAST_RATE", "100000")
+os.environ.setdefault("KICK_RATE", "100000")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db  # noqa: E402
+
+ADMIN_ID = 1
+CHANNEL_ID = -100123456789
+PROMO_CODE = "BENCH"
+FIRST_USER_ID = 10_000_000
+
+
+class DatabaseTimer:
+    """Оборачивает публичные корутины database.py и копит суммарное время и число вызовов."""
+
+    def __init__(self):
+        self.total = 0.0
+        self.calls = 0
+
+    def install(self):
+        for name, func in list(vars(db).items()):
+            if not name.startswith("_") and inspect.iscoroutinefunction(func) and func.__module__ == db.__name__:
+                setattr(db, name, self._wrap(func))
+
+    def _wrap(self, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.total += time.perf_counter() - started
+                self.calls += 1
+        return wrapper
+
+    def snapshot(self):
+        return self.total, self.calls
+
+
+db_timer = DatabaseTimer()
+db_timer.install()
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+
+import broadcast  # noqa: E402
+import main as bot_main  # noqa: E402
+from bench.fake_api import FakeBotAPI  # noqa: E402
+from bench.updates import (  # noqa: E402
+    make_callback_update, make_message_update, make_pre_checkout_update,
+    make_successful_payment_update, next_update_id,
+)
+import outbox  # noqa: E402
+import throttling  # noqa: E402
+from config import (  # noqa: E402
+    BOT_TOKEN, BROADCAST_RATE, KICK_RATE, OUTBOX_RATE,
+    THROTTLE_USER_LIMIT, THROTTLE_USER_WINDOW, THROTTLE_HANDLER_LIMIT, THROTTLE_HANDLER_WINDOW,
+)
+from fsm_storage import SQLiteStorage  # noqa: E402
+from invites import invite_pool  # noqa: E402
+from known_users import known_users  # noqa: E402
+from handlers import admin_handlers, user_handlers  # noqa: E402
+from promos import promo_index  # noqa: E402
+from tariffs import catalog  # noqa: E402
+
+
+def percentiles(samples):
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000
+    return {"p50": round(pick(50), 2), "p95": round(pick(95), 2), "p99": round(pick(99), 2), "max": round(ordered[-1] * 1000, 2)}
+
+
+def seed_database(path, users, expired):
+    """Заполняет базу пользователями напрямую через sqlite3, до открытия пула соединений бота."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, username TEXT, subscription_end_date INTEGER)")
+    past = int(time.time()) - 3600
+    rows = ((FIRST_USER_ID + i, f"seed{i}", past if i < expired else None) for i in range(users))
+    conn.executemany("INSERT INTO users (user_id, username, subscription_end_date) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.api = FakeBotAPI(port=args.api_port, latency=args.api_latency / 1000)
+        self.bot = None
+        self.dp = None
+        self.results = {}
+
+    async def setup(self, db_path):
+        await self.api.start()
+        await db.open_pool(db_path, readers=self.args.readers)
+        await db.init_db()
+        await db.set_setting('channel_id', str(CHANNEL_ID))
+        await catalog.add("Месяц", 300, 30)
+        await promo_index.create(PROMO_CODE, 20, 10 ** 9)
+        await known_users.load()
+
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.api.base_url))
+        self.bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+        # Лимиты на чат тоже снимаем: бенчмарк меряет сам бот, а не ограничения Telegram
+        self.outbox = outbox.setup(
+            self.bot, (user_handlers.router, admin_handlers.router), rate=OUTBOX_RATE,
+            lane_rates={outbox.REMINDER: KICK_RATE, outbox.BROADCAST: BROADCAST_RATE},
+            private_chat_rate=OUTBOX_RATE, group_chat_rate=OUTBOX_RATE,
+        )
+        self.dp = Dispatcher(storage=SQLiteStorage())
+        self.dp.include_router(user_handlers.router)
+        self.dp.include_router(admin_handlers.router)
+        throttling.setup(
+            self.dp, user_handlers.router, THROTTLE_USER_LIMIT, THROTTLE_USER_WINDOW, THROTTLE_HANDLER_LIMIT, THROTTLE_HANDLER_WINDOW,
+        )
+        invite_pool.start(self.bot)
+
+    async def teardown(self):
+        await broadcast.shutdown()
+        await invite_pool.stop()
+        await known_users.close()
+        await self.outbox.close()
+        await self.dp.storage.close()
+        await self.bot.session.close()
+        await db.close_pool()
+        await self.api.stop()
+
+    async def feed(self, update, samples):
+        started = time.perf_counter()
+        await self.dp.feed_raw_update(self.bot, update)
+        samples.append(time.perf_counter() - started)
+
+    async def run_scenario(self, name, body, units_name="updates"):
+        calls_before = dict(self.api.calls)
+        db_before = db_timer.snapshot()
+        samples = []
+        started = time.perf_counter()
+        units, extra = await body(samples)
+        elapsed = time.perf_counter() - started
+        db_total, db_calls = db_timer.snapshot()
+        self.results[name] = {
+            units_name: units,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_per_s": round(units / elapsed, 2) if elapsed else 0.0,
+            "handler_latency_ms": percentiles(samples),
+            "db_time_s": round(db_total - db_before[0], 3),
+            "db_calls": db_calls - db_before[1],
+            "api_calls": {m: n - calls_before.get(m, 0) for m, n in self.api.calls.items() if n - calls_before.get(m, 0)},
+            **extra,
+        }
+        logging.getLogger(__name__).warning(f"{name}: {json.dumps(self.results[name], ensure_ascii=False)}")
+
+    async def _gather_users(self, user_ids, per_user):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def guarded(user_id):
+            async with semaphore:
+                await per_user(user_id)
+
+        await asyncio.gather(*(guarded(user_id) for user_id in user_ids))
+
+    async def start_storm(self, samples):
+        # Повторные переходы по ссылкам: пользователи из базы, сверх ее размера — новые
+        user_ids = range(FIRST_USER_ID, FIRST_USER_ID + self.args.start)
+
+        async def per_user(user_id):
+            await self.feed(make_message_update(next_update_id(), user_id, "/start"), samples)
+
+        await self._gather_users(user_ids, per_user)
+        return len(user_ids), {}
+
+    async def payment_funnel(self, samples):
+        tariff_id = (await db.get_all_tariffs())[0][0]
+        user_ids = range(1, self.args.funnel + 1)
+
+        async def per_user(user_id):
+            await self.feed(make_message_update(next_update_id(), user_id, "💳 Оплата"), samples)
+            await self.feed(make_callback_update(next_update_id(), user_id, f"pay:{tariff_id}"), samples)
+            await self.feed(make_callback_update(next_update_id(), user_id, f"enter_promo:{tariff_id}"), samples)
+            await self.feed(make_message_update(next_update_id(), user_id, PROMO_CODE), samples)
+            await self.feed(make_callback_update(next_update_id(), user_id, f"final_pay:{tariff_id}:{PROMO_CODE}"), samples)
+            payload = self.api.invoices.pop(user_id)
+            price = int(payload.split(':')[3]) * 100
+            await self.feed(make_pre_checkout_update(next_update_id(), user_id, payload, price), samples)
+            await self.feed(make_successful_payment_update(next_update_id(), user_id, payload, price), samples)
+
+        await self._gather_users(user_ids, per_user)
+        revenue, sales = await db.get_sales_for_period()
+        return len(user_ids), {"payments_recorded": sales, "revenue_rub": revenue}
+
+    async def broadcast(self, samples):
+        for text in ("📤 Рассылка", "Нагрузочная рассылка", "Пропустить", "✅ Отправить всем"):
+            await self.feed(make_message_update(next_update_id(), ADMIN_ID, text), samples)
+        await asyncio.gather(*broadcast._tasks)
+        return self.args.users, {}
+
+    async def expiry_sweep(self, samples):
+        started = time.perf_counter()
+        await bot_main.check_subscriptions(self.bot)
+        samples.append(time.perf_counter() - started)
+        return self.args.expired, {}
+
+    async def run(self):
+        scenarios = {
+            "start": (self.start_storm, "updates"),
+            "funnel": (self.payment_funnel, "payments"),
+            "broadcast": (self.broadcast, "recipients"),
+            "expiry": (self.expiry_sweep, "expired_users"),
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "bench.db")
+            seed_database(db_path, self.args.users, self.args.expired)
+            await self.setup(db_path)
+            try:
+                for name in self.args.scenarios.split(","):
+                    body, units_name = scenarios[name]
+                    await self.run_scenario(name, body, units_name)
+            finally:
+                await self.teardown()
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "params": vars(self.args),
+            "scenarios": self.results,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд бота с поддельным Bot API.")
+    parser.add_argument("--scenarios", default="start,funnel,broadcast,expiry")
+    parser.add_argument("--users", type=int, default=100_000, help="пользователей в базе (получатели рассылки)")
+    parser.add_argument("--expired", type=int, default=2_000, help="из них с истекшей подпиской")
+    parser.add_argument("--start", type=int, default=5_000, help="количество /start в шквале")
+    parser.add_argument("--funnel", type=int, default=1_000, help="количество полных оплат")
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременно обрабатываемых пользователей")
+    parser.add_argument("--readers", type=int, default=4, help="соединений с БД на чтение")
+    parser.add_argument("--api-port", type=int, default=8082)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="искусственная задержка Bot API, мс")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    # main.py при импорте включает INFO-логирование; на стенде оставляем только итоги сценариев
+    logging.getLogger().setLevel(logging.WARNING)
+    result = asyncio.run(Bench(args).run())
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
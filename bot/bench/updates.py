@@ -0,0 +1,80 @@
+# bench/updates.py
+import itertools
+import time
+
+_ids = itertools.count(1)
+
+
+def next_update_id():
+    return next(_ids)
+
+
+def make_user(user_id, username=None):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": username or f"user{user_id}"}
+
+
+def _message(user_id, **fields):
+    message = {
+        "message_id": next(_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": make_user(user_id),
+    }
+    message.update(fields)
+    return message
+
+
+def make_message_update(update_id, user_id, text, **extra):
+    """Синтетическое обновление с текстовым сообщением от пользователя в личном чате."""
+    fields = {"text": text}
+    if text.startswith("/"):
+        command = text.split()[0]
+        fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    fields.update(extra)
+    return {"update_id": update_id, "message": _message(user_id, **fields)}
+
+
+def make_callback_update(update_id, user_id, data):
+    """Нажатие инлайн-кнопки под сообщением бота."""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": make_user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+                "text": "…",
+            },
+        },
+    }
+
+
+def make_pre_checkout_update(update_id, user_id, payload, amount):
+    return {
+        "update_id": update_id,
+        "pre_checkout_query": {
+            "id": str(update_id),
+            "from": make_user(user_id),
+            "currency": "RUB",
+            "total_amount": amount,
+            "invoice_payload": payload,
+        },
+    }
+
+
+def make_successful_payment_update(update_id, user_id, payload, amount):
+    return {
+        "update_id": update_id,
+        "message": _message(user_id, successful_payment={
+            "currency": "RUB",
+            "total_amount": amount,
+            "invoice_payload": payload,
+            "telegram_payment_charge_id": f"bench-{update_id}",
+            "provider_payment_charge_id": f"provider-{update_id}",
+        }),
+    }
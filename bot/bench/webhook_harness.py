@@ -0,0 +1,95 @@
+# bench/webhook_harness.py
+"""Сравнение задержки ответа бота в режимах webhook и polling.
+
+Стенд поднимает поддельный Bot API (bench/fake_api.py), ждет подключения бота и шлет ему
+синтетические /start от разных пользователей. Задержка считается от момента отправки
+обновления до первого исходящего вызова бота в этот чат.
+
+Запуск (в отдельной папке, чтобы не трогать рабочую базу):
+
+    # терминал 1 — бот
+    BOT_TOKEN=123456:bench ADMIN_IDS=1 PAYMENT_PROVIDER_TOKEN=test \\
+    TELEGRAM_API_URL=http://127.0.0.1:8081 \\
+    WEBHOOK_URL=http://127.0.0.1:8080 WEBHOOK_SECRET=bench python main.py   # без WEBHOOK_* — polling
+
+    # терминал 2 — стенд
+    python -m bench.webhook_harness --mode webhook --count 1000 --concurrency 50
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import aiohttp
+
+from bench.fake_api import FakeBotAPI
+from bench.updates import make_message_update
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run(args):
+    api = FakeBotAPI(port=args.api_port, latency=args.api_latency / 1000)
+    await api.start()
+    ready = api.webhook_set if args.mode == "webhook" else api.polling_started
+    print(f"Поддельный Bot API слушает {api.base_url}, жду подключения бота в режиме {args.mode}...")
+    await ready.wait()
+
+    update_ids = itertools.count(1)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, ack_latencies, timeouts = [], [], 0
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret}
+
+    async with aiohttp.ClientSession() as http:
+        async def one(i):
+            nonlocal timeouts
+            async with semaphore:
+                user_id = args.first_user_id + i
+                update = make_message_update(next(update_ids), user_id, "/start")
+                reply = api.wait_reply(user_id)
+                started = time.perf_counter()
+                if args.mode == "webhook":
+                    async with http.post(args.webhook, json=update, headers=headers) as response:
+                        response.raise_for_status()
+                    ack_latencies.append(time.perf_counter() - started)
+                else:
+                    api.push_update(update)
+                try:
+                    _, replied_at = await asyncio.wait_for(reply, timeout=args.timeout)
+                    latencies.append(replied_at - started)
+                except asyncio.TimeoutError:
+                    timeouts += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.count)))
+        elapsed = time.perf_counter() - started
+
+    await api.stop()
+    ms = lambda values, p: percentile(values, p) * 1000
+    print(f"Режим: {args.mode}, обновлений: {args.count}, без ответа: {timeouts}, {elapsed:.2f} с ({args.count / elapsed:.1f} обн./с)")
+    print(f"Ответ бота, мс: p50={ms(latencies, 50):.1f} p95={ms(latencies, 95):.1f} p99={ms(latencies, 99):.1f}")
+    if ack_latencies:
+        print(f"HTTP-ответ вебхука, мс: p50={ms(ack_latencies, 50):.1f} p95={ms(ack_latencies, 95):.1f} p99={ms(ack_latencies, 99):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Стенд для сравнения задержки webhook и polling.")
+    parser.add_argument("--mode", choices=("webhook", "polling"), default="webhook")
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/webhook", help="адрес вебхука бота")
+    parser.add_argument("--secret", default="bench", help="значение WEBHOOK_SECRET бота")
+    parser.add_argument("--api-port", type=int, default=8081, help="порт поддельного Bot API")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="искусственная задержка Bot API, мс")
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--first-user-id", type=int, default=10_000_000)
+    parser.add_argument("--timeout", type=float, default=10.0, help="сколько ждать ответа бота, с")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
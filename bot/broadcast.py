@@ -0,0 +1,148 @@
+# broadcast.py
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+
+import database as db
+from known_users import is_unreachable, known_users
+from outbox import BROADCAST, lane
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 200
+PARALLEL_SENDS = 10
+PROGRESS_INTERVAL = 5
+
+_tasks = set()
+
+
+class BroadcastJob:
+    """Состояние одной рассылки; курсор — последний обработанный user_id.
+
+    `skipped` — заблокировавшие бота до начала рассылки (им не пишем), `blocked` — заблокировавшие по ходу.
+    """
+
+    def __init__(self, broadcast_id, admin_chat_id, status_message_id, text, photo_id, total,
+                 cursor=0, sent=0, failed=0, skipped=0, blocked=0):
+        self.id = broadcast_id
+        self.admin_chat_id = admin_chat_id
+        self.status_message_id = status_message_id
+        self.text = text
+        self.photo_id = photo_id
+        self.total = total
+        self.cursor = cursor
+        self.sent = sent
+        self.failed = failed
+        self.skipped = skipped
+        self.blocked = blocked
+        self.newly_blocked = []
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.blocked
+
+    def progress_text(self, finished=False):
+        done = self.done
+        if finished:
+            header = "✅ Рассылка завершена!"
+        else:
+            percent = done * 100 // self.total if self.total else 100
+            header = f"📤 Рассылка в процессе: {percent}%"
+        return (
+            f"{header}\n\nОбработано: {done} из {self.total}\nОтправлено: {self.sent}\nОшибок: {self.failed}\n"
+            f"Заблокировали бота: {self.blocked}\nПропущено (заблокировали ранее): {self.skipped}"
+        )
+
+
+async def start_broadcast(bot: Bot, admin_chat_id: int, text: str, photo_id: str = None):
+    """Создает рассылку в БД и запускает ее в фоне, не блокируя обработчик админа."""
+    broadcast_id, total, skipped = await db.create_broadcast(admin_chat_id, text, photo_id)
+    job = BroadcastJob(broadcast_id, admin_chat_id, None, text, photo_id, total, skipped=skipped)
+    status = await bot.send_message(admin_chat_id, job.progress_text())
+    job.status_message_id = status.message_id
+    await db.set_broadcast_status_message(broadcast_id, status.message_id)
+    _spawn(bot, job)
+    return job
+
+
+async def resume_broadcasts(bot: Bot):
+    """Продолжает рассылки, прерванные перезапуском бота, с сохраненного курсора."""
+    for row in await db.get_unfinished_broadcasts():
+        job = BroadcastJob(*row)
+        logger.info(f"Возобновляю рассылку #{job.id} с пользователя {job.cursor} ({job.done}/{job.total}).")
+        _spawn(bot, job)
+
+
+async def shutdown():
+    """Останавливает фоновые рассылки; прогресс уже сохранен в БД и продолжится после запуска."""
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+
+
+def _spawn(bot: Bot, job: BroadcastJob):
+    # Задача наследует полосу при создании: все ее запросы к Bot API идут с самым низким приоритетом
+    with lane(BROADCAST):
+        task = asyncio.create_task(_run(bot, job))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _send_one(bot: Bot, job: BroadcastJob, user_id: int):
+    try:
+        if job.photo_id:
+            await bot.send_photo(user_id, job.photo_id, caption=job.text)
+        else:
+            await bot.send_message(user_id, job.text)
+        job.sent += 1
+    except Exception as e:
+        if is_unreachable(e):
+            job.blocked += 1
+            job.newly_blocked.append(user_id)
+        else:
+            job.failed += 1
+
+
+async def _update_status(bot: Bot, job: BroadcastJob, finished=False):
+    if not job.status_message_id:
+        return
+    try:
+        await bot.edit_message_text(job.progress_text(finished), chat_id=job.admin_chat_id, message_id=job.status_message_id)
+    except Exception as e:
+        logger.debug(f"Не удалось обновить статус рассылки #{job.id}: {e}")
+
+
+async def _run(bot: Bot, job: BroadcastJob):
+    semaphore = asyncio.Semaphore(PARALLEL_SENDS)
+
+    async def send(user_id):
+        async with semaphore:
+            await _send_one(bot, job, user_id)
+
+    last_update = time.monotonic()
+    try:
+        while True:
+            user_ids = await db.get_user_ids_after(job.cursor, CHUNK_SIZE)
+            if not user_ids:
+                break
+            await asyncio.gather(*(send(user_id) for user_id in user_ids))
+            job.cursor = user_ids[-1]
+            # Заблокировавших отмечаем пачкой на порцию, а не запросом на каждую ошибку
+            await known_users.mark_blocked(job.newly_blocked)
+            job.newly_blocked.clear()
+            await db.save_broadcast_progress(job.id, job.cursor, job.sent, job.failed, job.blocked)
+            if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+                await _update_status(bot, job)
+                last_update = time.monotonic()
+        await db.save_broadcast_progress(job.id, job.cursor, job.sent, job.failed, job.blocked, status='done')
+        await _update_status(bot, job, finished=True)
+        logger.info(
+            f"Рассылка #{job.id} завершена: отправлено {job.sent}, ошибок {job.failed}, "
+            f"заблокировали бота {job.blocked}, пропущено {job.skipped}."
+        )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Рассылка #{job.id} прервана ошибкой и будет продолжена после перезапуска: {e}")
@@ -20,4 +20,60 @@ except ValueError:
 # --- ИЗМЕНЕНИЕ ЗДЕСЬ: Возвращаемся к одному токену ---
 PAYMENT_PROVIDER_TOKEN = os.getenv('PAYMENT_PROVIDER_TOKEN')
 if not PAYMENT_PROVIDER_TOKEN:
-    raise ValueError("Необходимо указать PAYMENT_PROVIDER_TOKEN в файле .env")
\ No newline at end of file
+    raise ValueError("Необходимо указать PAYMENT_PROVIDER_TOKEN в файле .env")
+
+# --- База данных ---
+# Количество постоянных соединений на чтение в пуле (запись всегда идет через одно соединение)
+DB_READ_CONNECTIONS = int(os.getenv('DB_READ_CONNECTIONS', '4'))
+# Через сколько секунд перечитывать настройки из БД (0 — держать в памяти до перезапуска)
+SETTINGS_CACHE_TTL = int(os.getenv('SETTINGS_CACHE_TTL', '0')) or None
+# Состояния FSM: через сколько секунд простоя сбрасывать незавершенный диалог и сколько ключей держать в памяти
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', '86400'))
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))
+# Профилирование запросов (1 — включить): статистика по функциям БД и лог вызовов дольше DB_SLOW_QUERY_MS
+DB_PROFILE = os.getenv('DB_PROFILE', '0') == '1'
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '100'))
+
+# --- Исходящие запросы к Bot API ---
+# Общий лимит Telegram — около 30 сообщений в секунду на бота; все запросы проходят через одну очередь
+OUTBOX_RATE = float(os.getenv('OUTBOX_RATE', '30'))
+
+# --- Кик пользователей с истекшей подпиской ---
+# Сколько пользователей обрабатывается параллельно и сколько запросов в секунду отдается киком и напоминаниям
+KICK_CONCURRENCY = int(os.getenv('KICK_CONCURRENCY', '5'))
+KICK_RATE = float(os.getenv('KICK_RATE', '20'))
+
+# --- Рассылки ---
+# Потолок для рассылок ниже общего лимита, чтобы оставался запас для остального трафика
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+
+# --- Пул пригласительных ссылок ---
+# Сколько одноразовых ссылок в канал держать наготове, сколько живет каждая (с) и как часто пополнять пул (с)
+INVITE_POOL_SIZE = int(os.getenv('INVITE_POOL_SIZE', '20'))
+INVITE_LINK_TTL = int(os.getenv('INVITE_LINK_TTL', '86400'))
+INVITE_POOL_REFILL_INTERVAL = float(os.getenv('INVITE_POOL_REFILL_INTERVAL', '60'))
+
+# --- Ограничение частоты запросов пользователей ---
+# Общий лимит апдейтов от одного пользователя и лимит на каждый обработчик (запросов за окно в секундах)
+THROTTLE_USER_LIMIT = int(os.getenv('THROTTLE_USER_LIMIT', '30'))
+THROTTLE_USER_WINDOW = float(os.getenv('THROTTLE_USER_WINDOW', '10'))
+THROTTLE_HANDLER_LIMIT = int(os.getenv('THROTTLE_HANDLER_LIMIT', '5'))
+THROTTLE_HANDLER_WINDOW = float(os.getenv('THROTTLE_HANDLER_WINDOW', '5'))
+
+# --- Режим получения обновлений ---
+# Если указан WEBHOOK_URL (публичный адрес бота, например https://bot.example.com), бот работает через вебхук,
+# иначе — через long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    raise ValueError("Для работы через вебхук необходимо указать WEBHOOK_SECRET в файле .env")
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8080'))
+# Адрес Bot API (для локального Bot API сервера или стенда нагрузочного тестирования)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+# --- Метрики ---
+# Порт HTTP-эндпоинта /metrics в формате Prometheus (0 — не запускать)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
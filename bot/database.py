@@ -1,235 +1,733 @@
-import aiosqlite
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 
+import aiosqlite
+
+import migrations
+
 DB_NAME = 'bot_database.db'
 
-async def init_db():
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                subscription_end_date TEXT
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS tariffs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                price INTEGER NOT NULL,
-                duration_days INTEGER NOT NULL
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                tariff_name TEXT NOT NULL,
-                price INTEGER NOT NULL,
-                duration_days INTEGER NOT NULL,
-                payment_date TEXT NOT NULL,
-                telegram_payment_id TEXT UNIQUE NOT NULL,
-                FOREIGN KEY(user_id) REFERENCES users(user_id)
-            )
-        ''')
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS promo_codes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                code_text TEXT UNIQUE NOT NULL,
-                discount_percent INTEGER NOT NULL,
-                max_uses INTEGER NOT NULL,
-                uses_count INTEGER DEFAULT 0,
-                is_active BOOLEAN DEFAULT 1
-            )
-        ''')
+logger = logging.getLogger(__name__)
+
+# --- ПУЛ СОЕДИНЕНИЙ ---
+# Одно соединение на запись (SQLite всё равно допускает только одного писателя)
+# и несколько соединений на чтение. В режиме WAL читатели не блокируют писателя.
+_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+_STATEMENT_CACHE_SIZE = 256
+
+_writer = None
+_writer_lock = asyncio.Lock()
+_readers = None
+_reader_connections = []
+# Вызываются с каждым новым соединением пула (например, для профилирования запросов)
+_connection_hooks = []
+
+
+def add_connection_hook(callback):
+    _connection_hooks.append(callback)
+
+
+async def _open_connection(path):
+    conn = await aiosqlite.connect(path, cached_statements=_STATEMENT_CACHE_SIZE)
+    for pragma in _PRAGMAS:
+        await conn.execute(pragma)
+    for callback in _connection_hooks:
+        callback(conn)
+    return conn
+
+
+async def open_pool(path=DB_NAME, readers=4):
+    """Открывает постоянные соединения с базой: одно на запись и `readers` на чтение."""
+    global _writer, _readers
+    if _writer is not None:
+        return
+    _writer = await _open_connection(path)
+    _readers = asyncio.Queue()
+    for _ in range(max(1, readers)):
+        conn = await _open_connection(path)
+        await conn.execute("PRAGMA query_only = ON")
+        _reader_connections.append(conn)
+        _readers.put_nowait(conn)
+    logger.info(f"Открыт пул соединений с {path}: 1 на запись, {len(_reader_connections)} на чтение.")
+
+
+async def close_pool():
+    """Закрывает все соединения пула. Незавершенные записи дожидаются своей очереди."""
+    global _writer, _readers
+    if _writer is None:
+        return
+    await migrations.stop_backfills()
+    async with _writer_lock:
+        await _writer.close()
+        _writer = None
+    for conn in _reader_connections:
+        await conn.close()
+    _reader_connections.clear()
+    _readers = None
+
+
+@asynccontextmanager
+async def _read():
+    """Выдает свободное соединение на чтение и возвращает его в пул после использования."""
+    conn = await _readers.get()
+    try:
+        yield conn
+    finally:
+        _readers.put_nowait(conn)
+
+
+@asynccontextmanager
+async def _write():
+    """Выдает соединение на запись под блокировкой; на выходе делает COMMIT (или ROLLBACK при ошибке)."""
+    async with _writer_lock:
+        try:
+            yield _writer
+        except BaseException:
+            await _writer.rollback()
+            raise
+        await _writer.commit()
+
+
+def _now():
+    """Текущее время в unix-секундах: все даты в базе хранятся так (UTC, без часового пояса)."""
+    return int(time.time())
+
+
+# --- ПОДПИСЧИКИ НА ИЗМЕНЕНИЕ ПОДПИСОК ---
+# Вызываются после фиксации транзакции с (user_id, новая дата окончания или None)
+_subscription_listeners = []
+
+
+def add_subscription_listener(callback):
+    _subscription_listeners.append(callback)
+
+
+def _notify_subscription(user_id, end_date):
+    for callback in _subscription_listeners:
+        try:
+            callback(user_id, end_date)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике изменения подписки пользователя {user_id}: {e}")
+
+
+# --- КЭШ НАСТРОЕК ---
+# Настройки меняются несколько раз в год, а читаются на каждый /start и каждую оплату,
+# поэтому держим их в памяти. Запись идет сквозь кэш (write-through).
+_settings = {}
+_settings_loaded_at = 0.0
+_settings_ttl = None
+
+
+async def _load_settings(db):
+    global _settings, _settings_loaded_at
+    rows = await db.execute_fetchall("SELECT key, value FROM settings")
+    _settings = dict(rows)
+    _settings_loaded_at = time.monotonic()
+
+
+# --- ДАТЫ СТАРЫХ БАЗ ---
+# Пока заполнение миграции 6 переводит строковые даты старой базы в unix-секунды, дата строки может
+# лежать только в старой колонке *_text, поэтому запросы читают даты через эти выражения (coalesce);
+# пишутся даты всегда в сами колонки. Когда заполнение закончено, чтение переключается на колонки.
+_subscription_end = "subscription_end_date"
+_no_subscription = "subscription_end_date IS NULL"
+_payment_date = "payment_date"
+# Старая колонка даты платежа NOT NULL: до ее удаления (миграция 13) новые платежи пишут в нее пустую строку
+_INSERT_PAYMENT = (
+    "INSERT INTO payments (user_id, tariff_name, price, duration_days, payment_date, telegram_payment_id{legacy_column}) "
+    "VALUES (?, ?, ?, ?, ?, ?{legacy_value}) ON CONFLICT(telegram_payment_id) DO NOTHING"
+)
+_insert_payment = _INSERT_PAYMENT.format(legacy_column="", legacy_value="")
+
 
+async def _load_date_columns(db):
+    global _subscription_end, _no_subscription, _payment_date, _insert_payment
+    legacy = await migrations.epoch_dates_pending(db)
+    _subscription_end = migrations.epoch_date('subscription_end_date', legacy)
+    # Для частичного индекса idx_users_lapsed условие должно содержать его собственное "IS NULL"
+    _no_subscription = "subscription_end_date IS NULL" + (" AND subscription_end_date_text IS NULL" if legacy else "")
+    _payment_date = migrations.epoch_date('payment_date', legacy)
+    columns = [row[1] for row in await db.execute_fetchall("PRAGMA table_info(payments)")]
+    if 'payment_date_text' in columns:
+        _insert_payment = _INSERT_PAYMENT.format(legacy_column=", payment_date_text", legacy_value=", ''")
+    else:
+        _insert_payment = _INSERT_PAYMENT.format(legacy_column="", legacy_value="")
+
+
+async def _finish_backfills():
+    # Заполнения закончены: даты уже в самих колонках, поэтому чтение переключается на них еще до того,
+    # как отложенная миграция удалит старые колонки; запись платежей ждет ее на блокировке писателя
+    async with _write() as db:
+        await _load_date_columns(db)
+        await migrations.migrate(db)
+        await _load_date_columns(db)
+
+
+async def init_db(settings_ttl=None):
+    """Применяет миграции схемы и загружает настройки в кэш. `settings_ttl` — через сколько секунд перечитывать настройки (None — никогда).
+
+    Порционные заполнения данных, зарегистрированные миграциями, продолжаются в фоне.
+    """
+    global _settings_ttl
+    _settings_ttl = settings_ttl
+    async with _write() as db:
+        await migrations.migrate(db)
         await db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('channel_id', '-100...'))
         await db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('welcome_photo_id', ''))
         await db.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ('about_text', 'Это текст по умолчанию об информации. Измените его в админ-панели.'))
-
-        await db.commit()
+        await _load_settings(db)
+        await _load_date_columns(db)
+    migrations.start_backfills(_write, _finish_backfills)
 
 async def create_promo_code(code_text, discount, max_uses):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
+    async with _write() as db:
+        cursor = await db.execute(
             "INSERT INTO promo_codes (code_text, discount_percent, max_uses) VALUES (?, ?, ?)",
             (code_text.upper(), discount, max_uses)
         )
-        await db.commit()
-
-async def get_promo_code_details(code_text):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute(
-            "SELECT id, discount_percent, max_uses, uses_count, is_active FROM promo_codes WHERE code_text = ?",
-            (code_text.upper(),)
-        )
-        return await cursor.fetchone()
+        return cursor.lastrowid
 
 async def get_all_promo_codes():
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _read() as db:
         cursor = await db.execute("SELECT id, code_text, discount_percent, uses_count, max_uses, is_active FROM promo_codes")
         return await cursor.fetchall()
 
 async def toggle_promo_code_activity(promo_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _write() as db:
         await db.execute("UPDATE promo_codes SET is_active = NOT is_active WHERE id = ?", (promo_id,))
-        await db.commit()
-
-async def increment_promo_code_use(code_text):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            "UPDATE promo_codes SET uses_count = uses_count + 1 WHERE code_text = ?",
-            (code_text.upper(),)
-        )
-        await db.commit()
 
 async def get_sales_for_period(days=None):
-    async with aiosqlite.connect(DB_NAME) as db:
+    """Выручка и число продаж за последние `days` календарных дней (включая сегодня) или за все время."""
+    async with _read() as db:
         if days:
-            start_date = datetime.now() - timedelta(days=days)
-            query = "SELECT SUM(price), COUNT(id) FROM payments WHERE payment_date >= ?"
-            cursor = await db.execute(query, (start_date.strftime("%Y-%m-%d %H:%M:%S"),))
+            start_day = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+            cursor = await db.execute("SELECT SUM(revenue), SUM(sales) FROM sales_daily WHERE day >= ?", (start_day,))
         else:
-            query = "SELECT SUM(price), COUNT(id) FROM payments"
-            cursor = await db.execute(query)
+            cursor = await db.execute("SELECT SUM(revenue), SUM(sales) FROM sales_daily")
         result = await cursor.fetchone()
-        return (result[0] or 0, result[1])
+        return (result[0] or 0, result[1] or 0)
 
 async def get_most_popular_tariff():
-    async with aiosqlite.connect(DB_NAME) as db:
-        query = "SELECT tariff_name, COUNT(id) as sales_count FROM payments GROUP BY tariff_name ORDER BY sales_count DESC LIMIT 1"
-        cursor = await db.execute(query)
+    async with _read() as db:
+        cursor = await db.execute("SELECT tariff_name, sales FROM sales_by_tariff ORDER BY sales DESC LIMIT 1")
         return await cursor.fetchone()
 
+async def _add_to_sales_rollups(db, payment_date, tariff_name, price):
+    # Сводка по дням ведется по местной дате, как и отчеты в админ-панели
+    day = datetime.fromtimestamp(payment_date).strftime("%Y-%m-%d")
+    await db.execute(
+        "INSERT INTO sales_daily (day, revenue, sales) VALUES (?, ?, 1) "
+        "ON CONFLICT(day) DO UPDATE SET revenue = revenue + excluded.revenue, sales = sales + 1",
+        (day, price)
+    )
+    await db.execute(
+        "INSERT INTO sales_by_tariff (tariff_name, revenue, sales) VALUES (?, ?, 1) "
+        "ON CONFLICT(tariff_name) DO UPDATE SET revenue = revenue + excluded.revenue, sales = sales + 1",
+        (tariff_name, price)
+    )
+
+async def rebuild_sales_rollups():
+    """Пересчитывает сводные таблицы статистики по всей истории платежей."""
+    async with _write() as db:
+        await db.execute("DELETE FROM sales_daily")
+        await db.execute("DELETE FROM sales_by_tariff")
+        await db.execute(
+            "INSERT INTO sales_daily (day, revenue, sales) "
+            f"SELECT date({_payment_date}, 'unixepoch', 'localtime') AS day, SUM(price), COUNT(*) FROM payments GROUP BY day"
+        )
+        await db.execute(
+            "INSERT INTO sales_by_tariff (tariff_name, revenue, sales) "
+            "SELECT tariff_name, SUM(price), COUNT(*) FROM payments GROUP BY tariff_name"
+        )
+        # Незаконченное фоновое заполнение сводок больше не нужно: иначе оно добавит уже учтенные платежи
+        await db.execute(
+            "UPDATE schema_backfills SET finished_at = ? WHERE name = 'sales_rollups' AND finished_at IS NULL",
+            (_now(),)
+        )
+
 async def get_user_subscription(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT subscription_end_date FROM users WHERE user_id = ?", (user_id,))
+    """Дата окончания подписки пользователя в unix-секундах или None."""
+    async with _read() as db:
+        cursor = await db.execute(f"SELECT {_subscription_end} FROM users WHERE user_id = ?", (user_id,))
         result = await cursor.fetchone()
         return result[0] if result else None
 
-async def get_users_nearing_expiry(days_left):
-    target_date_start = datetime.now() + timedelta(days=days_left - 1)
-    target_date_end = datetime.now() + timedelta(days=days_left)
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT user_id FROM users WHERE subscription_end_date BETWEEN ? AND ?", (target_date_start.strftime("%Y-%m-%d %H:%M:%S"), target_date_end.strftime("%Y-%m-%d %H:%M:%S")))
-        return await cursor.fetchall()
+async def apply_payment(user_id, tariff_name, price, duration, payment_id, promo_code=None):
+    """Применяет оплату одной транзакцией: запись платежа, сводная статистика, промокод и продление подписки.
 
-async def add_payment_record(user_id, tariff_name, price, duration, payment_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        payment_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        await db.execute("INSERT INTO payments (user_id, tariff_name, price, duration_days, payment_date, telegram_payment_id) VALUES (?, ?, ?, ?, ?, ?)", (user_id, tariff_name, price, duration, payment_date, payment_id))
-        await db.commit()
+    Возвращает новую дату окончания подписки или None, если платеж с таким telegram_payment_id уже был обработан
+    (тогда ничего не меняется).
+    """
+    async with _write() as db:
+        payment_date = _now()
+        cursor = await db.execute(_insert_payment, (user_id, tariff_name, price, duration, payment_date, payment_id))
+        if cursor.rowcount == 0:
+            return None
+        await _add_to_sales_rollups(db, payment_date, tariff_name, price)
+        if promo_code:
+            await db.execute("UPDATE promo_codes SET uses_count = uses_count + 1 WHERE code_text = ?", (promo_code.upper(),))
+        await db.execute(
+            "INSERT INTO users (user_id, first_paid_at) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET first_paid_at = coalesce(first_paid_at, excluded.first_paid_at)",
+            (user_id, payment_date)
+        )
+        new_end_date = await _extend_subscription(db, user_id, duration)
+    _notify_subscription(user_id, new_end_date)
+    return new_end_date
 
 async def get_tariff_details(tariff_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _read() as db:
         cursor = await db.execute("SELECT name, price, duration_days FROM tariffs WHERE id = ?", (tariff_id,))
         return await cursor.fetchone()
 
 async def get_setting(key):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT value FROM settings WHERE key = ?", (key,))
-        result = await cursor.fetchone()
-        return result[0] if result else None
+    """Возвращает значение настройки из кэша; в БД идет только по истечении TTL."""
+    if _settings_ttl and time.monotonic() - _settings_loaded_at > _settings_ttl:
+        async with _read() as db:
+            await _load_settings(db)
+    return _settings.get(key)
 
 async def set_setting(key, value):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE settings SET value = ? WHERE key = ?", (value, key))
-        await db.commit()
+    async with _write() as db:
+        await db.execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+    _settings[key] = value
 
 async def add_tariff(name, price, duration):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _write() as db:
         await db.execute("INSERT INTO tariffs (name, price, duration_days) VALUES (?, ?, ?)", (name, price, duration))
-        await db.commit()
 
 async def get_all_tariffs():
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _read() as db:
         cursor = await db.execute("SELECT id, name, price, duration_days FROM tariffs")
         return await cursor.fetchall()
 
 async def delete_tariff(tariff_id):
-     async with aiosqlite.connect(DB_NAME) as db:
+    async with _write() as db:
         await db.execute("DELETE FROM tariffs WHERE id = ?", (tariff_id,))
-        await db.commit()
 
 async def add_user(user_id, username):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)", (user_id, username))
-        await db.commit()
-
-# --- ЭТА ФУНКЦИЯ ЗАМЕНЕНА НА "УМНУЮ" ВЕРСИЮ ---
-async def update_subscription(user_id, days_to_add):
-    """Продлевает или выдает подписку, добавляя дни к текущей дате окончания."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT subscription_end_date FROM users WHERE user_id = ?", (user_id,))
-        current_end_date_str = (await cursor.fetchone())[0]
-        
-        start_date = datetime.now()
-        # Если подписка уже есть и она активна, точкой отсчета становится ее дата окончания
-        if current_end_date_str:
-            current_end_date = datetime.strptime(current_end_date_str, "%Y-%m-%d %H:%M:%S")
-            if current_end_date > start_date:
-                start_date = current_end_date
-        
-        new_end_date = start_date + timedelta(days=days_to_add)
-        
+    # Пользователь мог появиться без username (запись создана оплатой) — тогда дописываем его
+    async with _write() as db:
         await db.execute(
-            "UPDATE users SET subscription_end_date = ? WHERE user_id = ?",
-            (new_end_date.strftime("%Y-%m-%d %H:%M:%S"), user_id)
+            "INSERT INTO users (user_id, username) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username WHERE username IS NOT excluded.username",
+            (user_id, username)
+        )
+
+async def get_user_names():
+    """Все пользователи (user_id, username) по возрастанию user_id."""
+    async with _read() as db:
+        return await db.execute_fetchall("SELECT user_id, username FROM users ORDER BY user_id")
+
+async def update_usernames(changes):
+    """Записывает накопленные смены username одной транзакцией: changes — [(user_id, username)]."""
+    async with _write() as db:
+        await db.executemany(
+            "UPDATE users SET username = ? WHERE user_id = ?",
+            [(username, user_id) for user_id, username in changes]
         )
-        await db.commit()
-        # Возвращаем новую дату, чтобы показать ее пользователю
-        return new_end_date
+
+async def get_blocked_user_ids():
+    async with _read() as db:
+        return [row[0] for row in await db.execute_fetchall("SELECT user_id FROM users WHERE blocked_at IS NOT NULL")]
+
+async def mark_users_blocked(user_ids):
+    """Отмечает пользователей, до которых не доходят сообщения. Возвращает, сколько отмечено впервые."""
+    now = _now()
+    async with _write() as db:
+        cursor = await db.executemany(
+            "UPDATE users SET blocked_at = ? WHERE user_id = ? AND blocked_at IS NULL",
+            [(now, user_id) for user_id in user_ids]
+        )
+        return cursor.rowcount
+
+async def unblock_user(user_id):
+    async with _write() as db:
+        await db.execute("UPDATE users SET blocked_at = NULL WHERE user_id = ?", (user_id,))
+
+async def _extend_subscription(db, user_id, days_to_add):
+    # Если подписка уже есть и она активна, точкой отсчета становится ее дата окончания
+    cursor = await db.execute(
+        f"UPDATE users SET subscription_end_date = max(coalesce({_subscription_end}, 0), ?) + ?, reminder_sent = NULL "
+        "WHERE user_id = ? RETURNING subscription_end_date",
+        (_now(), days_to_add * 86400, user_id)
+    )
+    new_end_date = (await cursor.fetchone())[0]
+    return datetime.fromtimestamp(new_end_date)
 
 # --- ОСТАЛЬНЫЕ ФУНКЦИИ ОСТАЮТСЯ БЕЗ ИЗМЕНЕНИЙ ---
-async def get_expired_users():
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT user_id FROM users WHERE subscription_end_date IS NOT NULL AND subscription_end_date < ?", (now,))
-        expired = await cursor.fetchall()
-        for user_id in expired:
-            await db.execute("UPDATE users SET subscription_end_date = NULL WHERE user_id = ?", (user_id[0],))
-        await db.commit()
-        return expired
-
-async def get_all_user_ids():
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT user_id FROM users")
-        return [row[0] for row in await cursor.fetchall()]
+async def get_expired_users(channel_id=None):
+    """Одним запросом забирает все истекшие подписки: обнуляет дату и возвращает
+    (user_id, заблокировал ли бота, вышел ли уже из канала `channel_id` по данным channel_members).
+    """
+    async with _write() as db:
+        cursor = await db.execute(
+            "UPDATE users SET subscription_end_date = NULL, reminder_sent = NULL "
+            f"WHERE {_subscription_end} < ? RETURNING user_id, blocked_at IS NOT NULL, EXISTS ("
+            "SELECT 1 FROM channel_members m WHERE m.channel_id = ? AND m.user_id = users.user_id AND m.is_member = 0)",
+            (_now(), channel_id)
+        )
+        return await cursor.fetchall()
+
+async def get_active_subscriptions():
+    """Все пользователи с датой окончания подписки: (user_id, subscription_end_date в unix-секундах, reminder_sent)."""
+    # Заблокировавшим бота напоминания не нужны: reminder_sent = 0 означает «все уже отправлены», кик остается в силе
+    async with _read() as db:
+        return await db.execute_fetchall(
+            f"SELECT user_id, {_subscription_end}, CASE WHEN blocked_at IS NULL THEN reminder_sent ELSE 0 END "
+            f"FROM users WHERE {_subscription_end} IS NOT NULL"
+        )
+
+async def mark_reminder_sent(user_id, days_left):
+    async with _write() as db:
+        await db.execute("UPDATE users SET reminder_sent = ? WHERE user_id = ?", (days_left, user_id))
+
+async def get_user_ids_after(cursor, limit):
+    """Следующая порция ID получателей после `cursor` (keyset-пагинация по первичному ключу), без заблокировавших бота."""
+    async with _read() as db:
+        rows = await db.execute_fetchall(
+            "SELECT user_id FROM users WHERE user_id > ? AND blocked_at IS NULL ORDER BY user_id LIMIT ?",
+            (cursor, limit)
+        )
+        return [row[0] for row in rows]
+
+# --- СПИСОК ПОЛЬЗОВАТЕЛЕЙ В АДМИНКЕ ---
+# Фильтр -> (условие, ключ сортировки, частичный индекс). Для каждого фильтра есть индекс, в котором строки
+# уже лежат в порядке (ключ, user_id), поэтому страница читает только свои строки: keyset-пагинация без OFFSET.
+# {lower}/{upper} — границы диапазона по ключу; с курсором та из них, что с его стороны, отключается
+# унарным "+", чтобы SQLite начинал чтение индекса с курсора, а не с начала диапазона.
+# Частичные индексы задаются через INDEXED BY: для 'expired' SQLite иначе выбирает idx_users_subscription_end
+# и перебирает всех с пустой датой окончания, включая никогда не плативших.
+# {end}/{no_end} — дата окончания подписки и ее отсутствие (см. _load_date_columns).
+USER_FILTERS = {
+    'all': ("1", None, None),
+    'active': ("{lower}{end} > :now", "{end}", None),
+    'expired': ("first_paid_at IS NOT NULL AND {no_end}", None, "idx_users_lapsed"),
+    'never_paid': ("first_paid_at IS NULL", None, "idx_users_never_paid"),
+    'blocked': ("blocked_at IS NOT NULL", None, "idx_users_blocked"),
+    'search': (
+        "{lower}username >= :low COLLATE NOCASE AND {upper}username < :high COLLATE NOCASE", "username COLLATE NOCASE", None
+    ),
+}
+
+async def browse_users(filter_name, cursor=None, backward=False, limit=10, query=None):
+    """Страница списка пользователей: строки (user_id, username, subscription_end_date, blocked_at, ключ сортировки).
+
+    `cursor` — (ключ, user_id) крайней строки соседней страницы; `backward` — страница перед курсором.
+    Возвращается до limit + 1 строк: лишняя означает, что в этом направлении есть еще страница.
+    `query` — начало username для фильтра 'search'.
+    """
+    sql, params = _browse_users_query(filter_name, cursor, backward, limit, query)
+    async with _read() as db:
+        rows = await db.execute_fetchall(sql, params)
+    return list(reversed(rows)) if backward else list(rows)
+
+def _browse_users_query(filter_name, cursor, backward, limit, query):
+    condition, key, index = USER_FILTERS[filter_name]
+    condition = condition.format(
+        lower="+" if cursor is not None and not backward else "",
+        upper="+" if cursor is not None and backward else "",
+        end=_subscription_end,
+        no_end=_no_subscription,
+    )
+    key = key and key.format(end=_subscription_end)
+    params = {"now": _now(), "limit": limit + 1}
+    if filter_name == 'search':
+        # В username только латиница, цифры и "_", а "~" больше любого из этих символов
+        params["low"], params["high"] = query, query + "~"
+    order = f"{key}, user_id" if key else "user_id"
+    if cursor is not None:
+        sign = '<' if backward else '>'
+        if key:
+            condition += f" AND {key} {sign}= :cursor_key AND ({key} {sign} :cursor_key OR user_id {sign} :cursor_id)"
+        else:
+            condition += f" AND user_id {sign} :cursor_id"
+        params["cursor_key"], params["cursor_id"] = cursor
+    if backward:
+        order = ", ".join(f"{column} DESC" for column in order.split(", "))
+    indexed_by = f" INDEXED BY {index}" if index else ""
+    sql = (
+        f"SELECT user_id, username, {_subscription_end}, blocked_at, {key or 'user_id'} FROM users{indexed_by} "
+        f"WHERE {condition} ORDER BY {order} LIMIT :limit"
+    )
+    return sql, params
+
+# --- ВЫГРУЗКА ---
+# Строки читаются порциями по keyset-курсору, соединение возвращается в пул между порциями:
+# длинная выгрузка не занимает читателя надолго и не держит старый снимок WAL.
+_FAR_FUTURE = 2 ** 62
+
+async def iter_payments(start=None, end=None, tariff_name=None, batch=1000):
+    """Платежи с датой в [start, end) (unix-секунды) по возрастанию даты, порциями по `batch` строк.
+
+    Строка: (id, user_id, username, tariff_name, price, duration_days, payment_date, telegram_payment_id).
+    """
+    key, last_id = start or 0, 0
+    end = end or _FAR_FUTURE
+    while True:
+        async with _read() as db:
+            rows = await db.execute_fetchall(
+                f"SELECT p.id, p.user_id, u.username, p.tariff_name, p.price, p.duration_days, {_payment_date}, "
+                "p.telegram_payment_id FROM payments p LEFT JOIN users u ON u.user_id = p.user_id "
+                f"WHERE {_payment_date} >= :key AND ({_payment_date} > :key OR p.id > :id) AND {_payment_date} < :end "
+                "AND (:tariff IS NULL OR p.tariff_name = :tariff) "
+                f"ORDER BY {_payment_date}, p.id LIMIT :limit",
+                {"key": key, "id": last_id, "end": end, "tariff": tariff_name, "limit": batch}
+            )
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch:
+            return
+        last_id, key = rows[-1][0], rows[-1][6]
+
+async def iter_users(start=None, end=None, tariff_name=None, batch=1000):
+    """Пользователи по возрастанию ID, порциями по `batch` строк.
+
+    Период [start, end) отбирает впервые оплативших в нем, тариф — покупавших его хотя бы раз.
+    Строка: (user_id, username, subscription_end_date, first_paid_at, blocked_at).
+    """
+    conditions = ["user_id > :id"]
+    if start or end:
+        conditions.append("first_paid_at >= :start AND first_paid_at < :end")
+    if tariff_name:
+        conditions.append("EXISTS (SELECT 1 FROM payments p WHERE p.user_id = users.user_id AND p.tariff_name = :tariff)")
+    sql = (
+        f"SELECT user_id, username, {_subscription_end}, first_paid_at, blocked_at FROM users "
+        f"WHERE {' AND '.join(conditions)} ORDER BY user_id LIMIT :limit"
+    )
+    params = {"id": 0, "start": start or 0, "end": end or _FAR_FUTURE, "tariff": tariff_name, "limit": batch}
+    while True:
+        async with _read() as db:
+            rows = await db.execute_fetchall(sql, params)
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch:
+            return
+        params["id"] = rows[-1][0]
+
+# --- РАССЫЛКИ ---
+async def create_broadcast(admin_chat_id, text, photo_id):
+    """Сохраняет новую рассылку и возвращает ее ID, число получателей и число пропущенных (заблокировали бота)."""
+    async with _write() as db:
+        cursor = await db.execute(
+            "INSERT INTO broadcasts (admin_chat_id, text, photo_id, total, skipped, created_at) "
+            "VALUES (?, ?, ?, (SELECT COUNT(*) FROM users WHERE blocked_at IS NULL), "
+            "(SELECT COUNT(*) FROM users WHERE blocked_at IS NOT NULL), ?) RETURNING id, total, skipped",
+            (admin_chat_id, text, photo_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        )
+        return await cursor.fetchone()
+
+async def set_broadcast_status_message(broadcast_id, message_id):
+    async with _write() as db:
+        await db.execute("UPDATE broadcasts SET status_message_id = ? WHERE id = ?", (message_id, broadcast_id))
+
+async def save_broadcast_progress(broadcast_id, cursor, sent, failed, blocked, status='running'):
+    async with _write() as db:
+        await db.execute(
+            "UPDATE broadcasts SET cursor = ?, sent = ?, failed = ?, blocked = ?, status = ? WHERE id = ?",
+            (cursor, sent, failed, blocked, status, broadcast_id)
+        )
+
+async def get_unfinished_broadcasts():
+    async with _read() as db:
+        return await db.execute_fetchall(
+            "SELECT id, admin_chat_id, status_message_id, text, photo_id, total, cursor, sent, failed, skipped, blocked "
+            "FROM broadcasts WHERE status = 'running' ORDER BY id"
+        )
+
+# --- ПРИГЛАСИТЕЛЬНЫЕ ССЫЛКИ ---
+async def claim_invite_link(channel_id, user_id, min_expire):
+    """Атомарно выдает пользователю свободную ссылку пула, действующую хотя бы до `min_expire`.
+
+    Берется ссылка, которая истекает раньше всех. Возвращает (invite_link, expire_date) или None, если пул пуст.
+    """
+    async with _write() as db:
+        cursor = await db.execute(
+            "UPDATE invite_links SET claimed_by = ?, claimed_at = ? WHERE id = ("
+            "SELECT id FROM invite_links WHERE channel_id = ? AND claimed_by IS NULL AND expire_date >= ? "
+            "ORDER BY expire_date LIMIT 1) RETURNING invite_link, expire_date",
+            (user_id, _now(), channel_id, min_expire)
+        )
+        return await cursor.fetchone()
+
+async def add_invite_links(channel_id, links):
+    """Добавляет в пул созданные ссылки: links — [(invite_link, expire_date)]."""
+    now = _now()
+    async with _write() as db:
+        await db.executemany(
+            "INSERT INTO invite_links (channel_id, invite_link, expire_date, created_at) VALUES (?, ?, ?, ?)",
+            [(channel_id, link, expire_date, now) for link, expire_date in links]
+        )
+
+async def count_free_invite_links(channel_id, min_expire):
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT COUNT(*) FROM invite_links WHERE channel_id = ? AND claimed_by IS NULL AND expire_date >= ?",
+            (channel_id, min_expire)
+        )
+        return (await cursor.fetchone())[0]
+
+async def get_foreign_invite_links(channel_id):
+    """Свободные и еще действующие ссылки пула, ведущие не в `channel_id` (канал сменили): (channel_id, invite_link)."""
+    async with _read() as db:
+        return await db.execute_fetchall(
+            "SELECT channel_id, invite_link FROM invite_links WHERE claimed_by IS NULL AND channel_id != ? AND expire_date > ?",
+            (channel_id, _now())
+        )
+
+async def delete_stale_invite_links(channel_id, min_expire):
+    """Удаляет свободные ссылки, которые скоро истекут или ведут в прежний канал, и выданные с истекшим сроком."""
+    async with _write() as db:
+        cursor = await db.execute(
+            "DELETE FROM invite_links WHERE (claimed_by IS NULL AND (channel_id != ? OR expire_date < ?)) "
+            "OR (claimed_by IS NOT NULL AND expire_date < ?)",
+            (channel_id, min_expire, _now())
+        )
+        return cursor.rowcount
+
+# --- УЧАСТНИКИ КАНАЛА ---
+async def record_channel_join(channel_id, user_id, invite_link=None):
+    """Отмечает вступление в канал и использование ссылки.
+
+    Возвращает True, если у пользователя активная подписка; иначе участник помечается (flagged_at).
+    """
+    now = _now()
+    async with _write() as db:
+        cursor = await db.execute(f"SELECT {_subscription_end} > ? FROM users WHERE user_id = ?", (now, user_id))
+        row = await cursor.fetchone()
+        subscribed = bool(row and row[0])
+        await db.execute(
+            "INSERT INTO channel_members (channel_id, user_id, is_member, joined_at, invite_link, flagged_at) "
+            "VALUES (?, ?, 1, ?, ?, ?) ON CONFLICT(channel_id, user_id) DO UPDATE SET is_member = 1, "
+            "joined_at = excluded.joined_at, left_at = NULL, invite_link = excluded.invite_link, flagged_at = excluded.flagged_at",
+            (channel_id, user_id, now, invite_link, None if subscribed else now)
+        )
+        if invite_link:
+            await db.execute("UPDATE invite_links SET used_by = ?, used_at = ? WHERE invite_link = ?", (user_id, now, invite_link))
+        return subscribed
+
+async def record_channel_leave(channel_id, user_id):
+    async with _write() as db:
+        await db.execute(
+            "INSERT INTO channel_members (channel_id, user_id, is_member, left_at) VALUES (?, ?, 0, ?) "
+            "ON CONFLICT(channel_id, user_id) DO UPDATE SET is_member = 0, left_at = excluded.left_at",
+            (channel_id, user_id, _now())
+        )
+
+async def count_unpaid_members(channel_id):
+    """Сколько участников канала сейчас без активной подписки."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT COUNT(*) FROM channel_members m LEFT JOIN users u ON u.user_id = m.user_id "
+            f"WHERE m.channel_id = ? AND m.is_member = 1 AND ({_subscription_end} IS NULL OR {_subscription_end} <= ?)",
+            (channel_id, _now())
+        )
+        return (await cursor.fetchone())[0]
+
+# --- ТИКЕТЫ ПОДДЕРЖКИ ---
+async def create_ticket(user_id, question):
+    async with _write() as db:
+        cursor = await db.execute(
+            "INSERT INTO tickets (user_id, question, created_at) VALUES (?, ?, ?) RETURNING id",
+            (user_id, question, _now())
+        )
+        return (await cursor.fetchone())[0]
+
+async def add_ticket_messages(ticket_id, messages):
+    """Запоминает сообщения, которыми тикет разослан админам: messages — [(admin_chat_id, message_id)]."""
+    async with _write() as db:
+        await db.executemany(
+            "INSERT OR IGNORE INTO ticket_messages (admin_chat_id, message_id, ticket_id) VALUES (?, ?, ?)",
+            [(chat_id, message_id, ticket_id) for chat_id, message_id in messages]
+        )
+
+async def get_ticket_by_message(admin_chat_id, message_id):
+    """Тикет, на сообщение которого ответил админ: (ticket_id, user_id, status) или None."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT t.id, t.user_id, t.status FROM ticket_messages m JOIN tickets t ON t.id = m.ticket_id "
+            "WHERE m.admin_chat_id = ? AND m.message_id = ?",
+            (admin_chat_id, message_id)
+        )
+        return await cursor.fetchone()
+
+async def mark_ticket_answered(ticket_id, admin_id):
+    async with _write() as db:
+        await db.execute(
+            "UPDATE tickets SET status = 'answered', answered_at = ?, answered_by = ? WHERE id = ?",
+            (_now(), admin_id, ticket_id)
+        )
+
+async def get_open_tickets(limit=20):
+    """Самые старые открытые тикеты (id, user_id, question, created_at) и их общее число."""
+    async with _read() as db:
+        rows = await db.execute_fetchall(
+            "SELECT id, user_id, question, created_at FROM tickets WHERE status = 'open' ORDER BY id LIMIT ?",
+            (limit,)
+        )
+        cursor = await db.execute("SELECT COUNT(*) FROM tickets WHERE status = 'open'")
+        return rows, (await cursor.fetchone())[0]
+
+# --- СОСТОЯНИЯ FSM ---
+async def get_fsm_record(key):
+    """Возвращает (state, data_json, updated_at) для ключа FSM или None."""
+    async with _read() as db:
+        cursor = await db.execute("SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,))
+        return await cursor.fetchone()
+
+async def save_fsm_records(upserts, deletes):
+    """Записывает накопленные изменения FSM одной транзакцией: upserts — (key, state, data_json, updated_at)."""
+    async with _write() as db:
+        if upserts:
+            await db.executemany(
+                "INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+                upserts
+            )
+        if deletes:
+            await db.executemany("DELETE FROM fsm_states WHERE key = ?", [(key,) for key in deletes])
+
+async def delete_stale_fsm_records(older_than):
+    """Удаляет состояния, которые не менялись с момента `older_than` (unix time). Возвращает число удаленных."""
+    async with _write() as db:
+        cursor = await db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (older_than,))
+        return cursor.rowcount
 
 async def get_stats():
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with _read() as db:
         total_users = await db.execute("SELECT COUNT(*) FROM users")
         total_users_count = (await total_users.fetchone())[0]
-        active_subs = await db.execute("SELECT COUNT(*) FROM users WHERE subscription_end_date > ?", (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+        active_subs = await db.execute(f"SELECT COUNT(*) FROM users WHERE {_subscription_end} > ?", (_now(),))
         active_subs_count = (await active_subs.fetchone())[0]
         return total_users_count, active_subs_count
 
 async def get_user_profile(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT user_id, username, subscription_end_date FROM users WHERE user_id = ?", (user_id,))
+    async with _read() as db:
+        cursor = await db.execute(f"SELECT user_id, username, {_subscription_end} FROM users WHERE user_id = ?", (user_id,))
         return await cursor.fetchone()
 
 async def manually_update_subscription(user_id, days_to_add):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT subscription_end_date FROM users WHERE user_id = ?", (user_id,))
-        current_end_date_str = (await cursor.fetchone())[0]
-        start_date = datetime.now()
-        if current_end_date_str:
-            current_end_date = datetime.strptime(current_end_date_str, "%Y-%m-%d %H:%M:%S")
-            if current_end_date > start_date:
-                start_date = current_end_date
-        new_end_date = start_date + timedelta(days=days_to_add)
-        await db.execute("UPDATE users SET subscription_end_date = ? WHERE user_id = ?", (new_end_date.strftime("%Y-%m-%d %H:%M:%S"), user_id))
-        await db.commit()
-        return new_end_date
+    async with _write() as db:
+        new_end_date = await _extend_subscription(db, user_id, days_to_add)
+    _notify_subscription(user_id, new_end_date)
+    return new_end_date
 
 async def revoke_subscription(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET subscription_end_date = NULL WHERE user_id = ?", (user_id,))
-        await db.commit()
\ No newline at end of file
+    async with _write() as db:
+        await db.execute("UPDATE users SET subscription_end_date = NULL, reminder_sent = NULL WHERE user_id = ?", (user_id,))
+    _notify_subscription(user_id, None)
\ No newline at end of file
@@ -0,0 +1,150 @@
+# dbprofile.py
+import contextvars
+import functools
+import inspect
+import logging
+import time
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+# Открытие и закрытие пула не профилируем: это не запросы
+_SKIP = {"open_pool", "close_pool"}
+
+_enabled = False
+_slow_threshold = 0.1
+_stats = {}
+_plans = {}
+_statements = contextvars.ContextVar("dbprofile_statements", default=None)
+
+
+class FunctionStats:
+    __slots__ = ("calls", "total", "max", "rows", "slow")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow = 0
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable(slow_ms: float = 100):
+    """Включает профилирование всех публичных функций database.py.
+
+    Для каждой функции копятся число вызовов, суммарное и максимальное время и число
+    возвращенных строк. Вызовы дольше `slow_ms` миллисекунд пишутся в лог вместе с
+    выполненными запросами и их EXPLAIN QUERY PLAN. Вызывать до open_pool(), иначе
+    отдельные запросы внутри функций не будут видны.
+    """
+    global _enabled, _slow_threshold
+    if _enabled:
+        return
+    _enabled = True
+    _slow_threshold = slow_ms / 1000
+    for name, func in list(vars(db).items()):
+        if name.startswith("_") or name in _SKIP:
+            continue
+        if inspect.iscoroutinefunction(func) and func.__module__ == db.__name__:
+            setattr(db, name, _profiled(name, func))
+    db.add_connection_hook(_trace_connection)
+    logger.info(f"Профилирование БД включено, порог медленных вызовов {slow_ms} мс.")
+
+
+def _count_rows(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple):
+        return 1
+    return 0
+
+
+def _profiled(name, func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        statements = []
+        token = _statements.set(statements)
+        started = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            _statements.reset(token)
+            stats = _stats.get(name)
+            if stats is None:
+                stats = _stats[name] = FunctionStats()
+            stats.calls += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+        stats.rows += _count_rows(result)
+        if elapsed >= _slow_threshold:
+            stats.slow += 1
+            await _log_slow(name, elapsed, statements)
+        return result
+    return wrapper
+
+
+def _trace_connection(conn):
+    """Перехватывает execute/execute_fetchall/executemany соединения, чтобы знать, какие запросы выполнила функция."""
+    for method in ("execute", "execute_fetchall", "executemany"):
+        setattr(conn, method, _traced(getattr(conn, method)))
+
+
+def _traced(method):
+    async def wrapper(sql, *args, **kwargs):
+        statements = _statements.get()
+        if statements is None:
+            return await method(sql, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await method(sql, *args, **kwargs)
+        finally:
+            params = args[0] if args and method.__name__ != "executemany" else ()
+            statements.append((sql, params, time.perf_counter() - started))
+    return wrapper
+
+
+async def _explain(sql, params):
+    key = " ".join(sql.split())
+    if key not in _plans:
+        try:
+            async with db._read() as conn:
+                rows = await conn.execute_fetchall(f"EXPLAIN QUERY PLAN {sql}", params)
+            _plans[key] = "; ".join(row[3] for row in rows) or "—"
+        except Exception as e:
+            _plans[key] = f"план недоступен: {e}"
+    return _plans[key]
+
+
+async def _log_slow(name, elapsed, statements):
+    lines = [f"Медленный вызов БД {name}: {elapsed * 1000:.1f} мс, запросов {len(statements)}"]
+    for sql, params, seconds in statements:
+        query = " ".join(sql.split())
+        lines.append(f"  {seconds * 1000:.1f} мс: {query}")
+        if query.upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")):
+            lines.append(f"    план: {await _explain(sql, params)}")
+    logger.warning("\n".join(lines))
+
+
+def summary(limit: int = None) -> str:
+    """Сводка по функциям БД, отсортированная по суммарному времени."""
+    if not _stats:
+        return "Вызовов БД пока не было."
+    rows = sorted(_stats.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+    lines = [f"{'функция':<32}{'вызовы':>8}{'всего, мс':>12}{'сред, мс':>10}{'макс, мс':>10}{'строк':>9}{'медл.':>7}"]
+    for name, s in rows:
+        lines.append(
+            f"{name[:31]:<32}{s.calls:>8}{s.total * 1000:>12.1f}{s.total / s.calls * 1000:>10.2f}"
+            f"{s.max * 1000:>10.1f}{s.rows:>9}{s.slow:>7}"
+        )
+    return "\n".join(lines)
+
+
+def log_summary():
+    if _enabled:
+        logger.info(f"Профиль БД за время работы:\n{summary()}")
@@ -0,0 +1,174 @@
+# expiry.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+# За сколько дней до окончания подписки отправлять напоминания
+REMINDER_DAYS = (3, 1)
+# Пропущенное напоминание догоняем, только если до окончания осталось не меньше этой доли его срока:
+# «истекает завтра» за несколько секунд до окончания только путает
+CATCH_UP_SHARE = 0.5
+KICK = 0
+
+def _timestamp(end_date):
+    """Дата окончания в unix-секундах: из БД приходит число, от оплаты и ручного продления — datetime."""
+    if isinstance(end_date, datetime):
+        return end_date.timestamp()
+    return float(end_date)
+
+
+class ExpiryTimeline:
+    """Расписание окончаний подписок в памяти (куча по времени срабатывания).
+
+    Загружается один раз из users.subscription_end_date и дальше обновляется через
+    db.add_subscription_listener при каждой оплате, ручном продлении или аннулировании.
+    Кик и напоминания срабатывают ровно в момент наступления, без периодического сканирования
+    таблицы. Устаревшие события (подписку продлили) не удаляются из кучи, а пропускаются
+    при извлечении — по сравнению с актуальной датой окончания пользователя.
+
+    `on_expire()` — забирает и обрабатывает все истекшие подписки;
+    `on_remind(user_id, days_left)` — отправляет напоминание.
+    """
+
+    def __init__(self, on_expire, on_remind):
+        self.on_expire = on_expire
+        self.on_remind = on_remind
+        self._heap = []
+        self._ends = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._expire_task = None
+        self._expire_pending = False
+        self._reminder_tasks = set()
+        self._loading = None       # изменения, пришедшие во время load(): user_id -> новая дата окончания
+
+    def __len__(self):
+        return len(self._ends)
+
+    async def load(self):
+        """Строит расписание по всем текущим подпискам (единственный полный проход по таблице).
+
+        Оплаты во время запроса к БД не теряются: они запоминаются и применяются поверх снимка.
+        """
+        self._loading = {}
+        try:
+            rows = await db.get_active_subscriptions()
+        except BaseException:
+            self._loading = None
+            raise
+        heap, ends = [], {}
+        now = time.time()
+        for user_id, end_date, reminder_sent in rows:
+            end = _timestamp(end_date)
+            ends[user_id] = end
+            heap.extend(self._events(user_id, end, reminder_sent, now, catch_up=True))
+        heapq.heapify(heap)
+        self._heap, self._ends = heap, ends
+        changed, self._loading = self._loading, None
+        for user_id, end_date in changed.items():
+            self.update(user_id, end_date)
+        self._wakeup.set()
+        logger.info(f"Расписание окончаний подписок загружено: {len(self._ends)} активных подписок.")
+
+    def _events(self, user_id, end, reminder_sent, now, catch_up=False):
+        # Кик на секунду позже окончания: в БД дата хранится с точностью до секунды
+        events = [(end + 1, next(self._seq), user_id, end, KICK)]
+        overdue = None
+        for days in REMINDER_DAYS:
+            if reminder_sent is not None and reminder_sent <= days:
+                continue
+            due = end - days * 86400
+            if due > now:
+                events.append((due, next(self._seq), user_id, end, days))
+            elif catch_up and end - now >= days * 86400 * CATCH_UP_SHARE:
+                overdue = days
+        # Если бот был выключен и пропустил напоминания, отправляем только самое срочное из них
+        if overdue is not None:
+            events.append((now, next(self._seq), user_id, end, overdue))
+        return events
+
+    def update(self, user_id, end_date):
+        """Обработчик db.add_subscription_listener: новая дата окончания или None при аннулировании."""
+        if self._loading is not None:
+            self._loading[user_id] = end_date
+        if end_date is None:
+            self._ends.pop(user_id, None)
+            return
+        end = _timestamp(end_date)
+        self._ends[user_id] = end
+        for event in self._events(user_id, end, None, time.time()):
+            heapq.heappush(self._heap, event)
+        self._wakeup.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [t for t in (self._task, self._expire_task, *self._reminder_tasks) if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._fire_due()
+
+    def _fire_due(self):
+        now = time.time()
+        expired, reminders = False, []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, user_id, end, kind = heapq.heappop(self._heap)
+            if self._ends.get(user_id) != end:
+                continue  # подписку продлили или аннулировали после постановки события
+            if kind == KICK:
+                del self._ends[user_id]
+                expired = True
+            else:
+                reminders.append((user_id, kind))
+        if expired:
+            self._trigger_expire()
+        if reminders:
+            task = asyncio.create_task(self._send_reminders(reminders))
+            self._reminder_tasks.add(task)
+            task.add_done_callback(self._reminder_tasks.discard)
+
+    def _trigger_expire(self):
+        # Одновременно идет не больше одного прохода кика; истечения во время прохода объединяются в следующий
+        if self._expire_task and not self._expire_task.done():
+            self._expire_pending = True
+            return
+        self._expire_task = asyncio.create_task(self._expire())
+
+    async def _expire(self):
+        while True:
+            self._expire_pending = False
+            try:
+                await self.on_expire()
+            except Exception as e:
+                logger.error(f"Ошибка при обработке истекших подписок: {e}")
+            if not self._expire_pending:
+                return
+
+    async def _send_reminders(self, reminders):
+        for user_id, days in reminders:
+            try:
+                await self.on_remind(user_id, days)
+                await db.mark_reminder_sent(user_id, days)
+            except Exception as e:
+                logger.warning(f"Не удалось отправить напоминание за {days} дн. пользователю {user_id}: {e}")
@@ -0,0 +1,159 @@
+# export.py
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta
+from html import escape
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+# Строк на одну порцию: столько читается из базы, кодируется и сжимается за раз,
+# поэтому память выгрузки не зависит от числа строк в таблице
+CHUNK_ROWS = 1000
+# Больше Bot API отправить документом не даст
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+FORMATS = ("csv", "jsonl")
+# Источник строк, колонки и колонки с датами (unix-секунды -> местное время) для каждого вида выгрузки
+KINDS = {
+    'payments': (
+        db.iter_payments,
+        ("id", "user_id", "username", "tariff_name", "price", "duration_days", "payment_date", "telegram_payment_id"),
+        {"payment_date"},
+    ),
+    'users': (
+        db.iter_users,
+        ("user_id", "username", "subscription_end_date", "first_paid_at", "blocked_at"),
+        {"subscription_end_date", "first_paid_at", "blocked_at"},
+    ),
+}
+USAGE = (
+    "Использование: <code>/export payments|users [csv|jsonl] [ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]] [тариф=Название]</code>\n"
+    "Например: <code>/export payments 2025-01-01 2025-03-31 тариф=1 месяц</code>\n"
+    "Период — с первой даты по вторую включительно. Для пользователей период — дата первой оплаты, тариф — хотя бы одна его покупка."
+)
+
+_lock = asyncio.Lock()
+
+
+class ExportRequest:
+    """Параметры выгрузки: вид, формат, период [start, end) в unix-секундах и тариф."""
+
+    def __init__(self, kind, fmt="csv", start=None, end=None, tariff_name=None):
+        self.kind = kind
+        self.fmt = fmt
+        self.start = start
+        self.end = end
+        self.tariff_name = tariff_name
+
+    @classmethod
+    def parse(cls, args: str):
+        """Разбирает аргументы команды /export; ValueError с текстом для админа, если они некорректны."""
+        args = (args or "").strip()
+        tariff_name = None
+        if "тариф=" in args:
+            args, tariff_name = args.split("тариф=", 1)
+            tariff_name = tariff_name.strip() or None
+        words = args.split()
+        if not words or words[0] not in KINDS:
+            raise ValueError(USAGE)
+        request = cls(words[0], tariff_name=tariff_name)
+        dates = []
+        for word in words[1:]:
+            if word in FORMATS:
+                request.fmt = word
+                continue
+            try:
+                dates.append(datetime.strptime(word, "%Y-%m-%d"))
+            except ValueError:
+                raise ValueError(f"Не понял «{escape(word)}».\n\n{USAGE}")
+        if len(dates) > 2:
+            raise ValueError(USAGE)
+        if dates:
+            request.start = int(dates[0].timestamp())
+        if len(dates) == 2:
+            # Конечная дата включительно, по местному времени — как в статистике
+            request.end = int((dates[1] + timedelta(days=1)).timestamp())
+            if request.end <= request.start:
+                raise ValueError("Конечная дата раньше начальной.")
+        return request
+
+    @property
+    def filename(self):
+        parts = [self.kind]
+        if self.start:
+            parts.append(datetime.fromtimestamp(self.start).strftime("%Y%m%d"))
+        if self.end:
+            parts.append(datetime.fromtimestamp(self.end - 1).strftime("%Y%m%d"))
+        return f"{'_'.join(parts)}.{self.fmt}.gz"
+
+
+def is_running() -> bool:
+    return _lock.locked()
+
+
+def _format_date(value):
+    return datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:%M:%S") if value else None
+
+
+def _encode(rows, columns, date_columns, fmt, header=False) -> bytes:
+    """Кодирует порцию строк в CSV или JSON Lines."""
+    date_positions = [i for i, column in enumerate(columns) if column in date_columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if header and writer:
+        writer.writerow(columns)
+    for row in rows:
+        row = list(row)
+        for i in date_positions:
+            row[i] = _format_date(row[i])
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+            buffer.write("\n")
+    return buffer.getvalue().encode("utf-8")
+
+
+async def write_export(request: ExportRequest, path: str) -> int:
+    """Пишет выгрузку в gzip-файл `path` порциями по CHUNK_ROWS строк. Возвращает число строк.
+
+    Сжатие и запись в файл идут в отдельном потоке, чтобы не останавливать обработку апдейтов.
+    """
+    source, columns, date_columns = KINDS[request.kind]
+    count = 0
+    gz = gzip.open(path, "wb", compresslevel=6)
+    try:
+        if request.fmt == "csv":
+            await asyncio.to_thread(gz.write, _encode((), columns, date_columns, "csv", header=True))
+        async for rows in source(request.start, request.end, request.tariff_name, batch=CHUNK_ROWS):
+            chunk = _encode(rows, columns, date_columns, request.fmt)
+            await asyncio.to_thread(gz.write, chunk)
+            count += len(rows)
+    finally:
+        await asyncio.to_thread(gz.close)
+    return count
+
+
+async def export_to_file(request: ExportRequest):
+    """Выгрузка во временный файл: (путь, число строк). Файл удаляет вызывающий.
+
+    Одновременно выполняется только одна выгрузка.
+    """
+    async with _lock:
+        fd, path = tempfile.mkstemp(suffix=".gz", prefix="export_")
+        os.close(fd)
+        try:
+            count = await write_export(request, path)
+        except BaseException:
+            os.remove(path)
+            raise
+        logger.info(f"Выгрузка {request.filename}: {count} строк, {os.path.getsize(path)} байт.")
+        return path, count
@@ -0,0 +1,157 @@
+# fsm_storage.py
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state=None, data=None, updated_at=0):
+        self.state = state
+        self.data = data or {}
+        self.updated_at = updated_at
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в той же SQLite-базе, что и бот.
+
+    Перед базой стоит LRU-кэш на `cache_size` ключей. Изменения состояния и данных копятся
+    в памяти и раз в `flush_interval` секунд пишутся в БД одной транзакцией, так что
+    set_state + update_data в одном обработчике дают одну запись. Состояния, к которым
+    не прикасались дольше `ttl` секунд, удаляются из памяти и из БД.
+    """
+
+    def __init__(self, ttl: int = 86400, cache_size: int = 10000, flush_interval: float = 1.0, sweep_interval: float = 600):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._task = None
+        self._last_sweep = time.monotonic()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) if part is not None else "" for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    def _expired(self, updated_at) -> bool:
+        return bool(self.ttl) and updated_at < time.time() - self.ttl
+
+    async def _get_entry(self, key: StorageKey) -> _Entry:
+        key_str = self._key(key)
+        entry = self._cache.get(key_str)
+        if entry is not None:
+            if entry.updated_at and self._expired(entry.updated_at):
+                entry.state, entry.data = None, {}
+            self._cache.move_to_end(key_str)
+            return entry
+        record = await db.get_fsm_record(key_str)
+        entry = self._cache.get(key_str)  # пока читали из БД, ключ мог быть записан
+        if entry is not None:
+            return entry
+        if record and not self._expired(record[2]):
+            entry = _Entry(record[0], json.loads(record[1]) if record[1] else {}, record[2])
+        else:
+            entry = _Entry()
+        self._remember(key_str, entry)
+        return entry
+
+    def _remember(self, key_str: str, entry: _Entry):
+        self._cache[key_str] = entry
+        self._cache.move_to_end(key_str)
+        # Вытесняем самые старые ключи; несохраненные пропускаем — их заберет ближайший flush
+        excess = len(self._cache) - self.cache_size
+        for old_key in list(islice(self._cache, max(0, excess))):
+            if old_key not in self._dirty:
+                del self._cache[old_key]
+
+    def _touch(self, key: StorageKey, entry: _Entry):
+        key_str = self._key(key)
+        entry.updated_at = int(time.time())
+        self._remember(key_str, entry)
+        self._dirty.add(key_str)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._get_entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._touch(key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get_entry(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        entry = await self._get_entry(key)
+        entry.data = dict(data)
+        self._touch(key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get_entry(key)).data.copy()
+
+    async def flush(self):
+        """Сохраняет все накопленные изменения одной транзакцией."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key_str in dirty:
+            entry = self._cache.get(key_str)
+            if entry is None:
+                continue
+            if entry.state is None and not entry.data:
+                deletes.append(key_str)
+            else:
+                upserts.append((key_str, entry.state, json.dumps(entry.data, ensure_ascii=False), entry.updated_at))
+        try:
+            await db.save_fsm_records(upserts, deletes)
+        except BaseException:
+            self._dirty |= dirty
+            raise
+
+    async def sweep(self):
+        """Удаляет состояния, простаивающие дольше TTL, из памяти и из БД."""
+        if not self.ttl:
+            return
+        threshold = int(time.time()) - self.ttl
+        for key_str in [k for k, e in self._cache.items() if e.updated_at < threshold and k not in self._dirty]:
+            del self._cache[key_str]
+        removed = await db.delete_stale_fsm_records(threshold)
+        if removed:
+            logger.info(f"Удалено {removed} устаревших состояний FSM.")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_sweep >= self.sweep_interval:
+                    self._last_sweep = time.monotonic()
+                    await self.sweep()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить состояния FSM: {e}")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
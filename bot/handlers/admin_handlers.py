@@ -1,34 +1,44 @@
-import asyncio
-import re
 import logging
+import os
 from datetime import datetime
+from html import escape
 from aiogram import Router, F, Bot
-from aiogram.filters import Command
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, FSInputFile
 
+import broadcast
 import database as db
+import dbprofile
+import export
 import keyboards as kb
 from config import ADMIN_IDS
+from invites import get_channel_id
+from known_users import is_unreachable, known_users
+from promos import promo_index
 from states import AdminStates
+from tariffs import catalog
 
 router = Router()
 logger = logging.getLogger(__name__)
 router.message.filter(F.from_user.id.in_(ADMIN_IDS))
+# Кнопки админки (список пользователей, карточки, тарифы, промокоды) тоже только для админов
+router.callback_query.filter(F.from_user.id.in_(ADMIN_IDS))
 
 @router.message(F.text == "🎟️ Промокоды")
 async def manage_promo_codes(message: Message):
     """Показывает меню управления промокодами."""
-    await message.answer("Меню управления промокодами:", reply_markup=await kb.get_promo_codes_management_kb())
+    await message.answer("Меню управления промокодами:", reply_markup=kb.get_promo_codes_management_kb(promo_index.rows()))
 
 @router.callback_query(F.data.startswith("toggle_promo:"))
 async def toggle_promo_handler(callback: CallbackQuery):
     """Активирует/деактивирует промокод."""
     promo_id = int(callback.data.split(':')[1])
-    await db.toggle_promo_code_activity(promo_id)
+    await promo_index.toggle(promo_id)
     await callback.answer("Статус промокода изменен.")
     # Обновляем клавиатуру, чтобы показать изменения
-    await callback.message.edit_reply_markup(reply_markup=await kb.get_promo_codes_management_kb())
+    await callback.message.edit_reply_markup(reply_markup=kb.get_promo_codes_management_kb(promo_index.rows()))
 
 @router.callback_query(F.data == "create_promo")
 async def create_promo_start(callback: CallbackQuery, state: FSMContext):
@@ -42,7 +52,7 @@ async def process_promo_text(message: Message, state: FSMContext):
     """Обрабатывает введенный текст промокода."""
     code_text = message.text.upper()
     # Проверка, не занят ли уже такой код
-    if await db.get_promo_code_details(code_text):
+    if promo_index.get(code_text):
         await message.answer("Такой промокод уже существует. Придумайте другой.")
         return
     
@@ -73,34 +83,101 @@ async def process_promo_max_uses(message: Message, state: FSMContext):
     discount = data.get('promo_discount')
     max_uses = int(message.text)
     
-    await db.create_promo_code(code_text, discount, max_uses)
+    await promo_index.create(code_text, discount, max_uses)
     await state.clear()
     
     await message.answer(f"✅ Промокод <code>{code_text}</code> на {discount}% (лимит: {max_uses} использований) успешно создан!", reply_markup=kb.get_admin_panel())
 
 @router.message(F.reply_to_message)
 async def admin_reply_to_ticket(message: Message, bot: Bot):
-    original_message = message.reply_to_message
-    # Проверяем, что это ответ на тикет и в нем есть текст (а не просто фото или стикер)
-    if original_message.text and "User ID:" in original_message.text:
-        match = re.search(r"User ID: (\d+)", original_message.text)
-        if match:
-            user_id = int(match.group(1))
-            response_text = f"💬 <b>Ответ от поддержки:</b>\n\n{message.text}"
-            try:
-                await bot.send_message(user_id, response_text)
-                await message.answer("✅ Ваш ответ успешно отправлен пользователю.")
-            except Exception as e:
-                logger.error(f"Не удалось отправить ответ пользователю {user_id}: {e}")
-                await message.answer(f"❌ Не удалось отправить ответ пользователю {user_id}. Возможно, он заблокировал бота.")
+    # Тикет ищется по (чат админа, message_id) сообщения, на которое ответили, — по первичному ключу
+    ticket = await db.get_ticket_by_message(message.chat.id, message.reply_to_message.message_id)
+    if ticket is None:
+        # Обычный ответ на сообщение, не на тикет — пусть его обработают остальные хендлеры
+        raise SkipHandler()
+    ticket_id, user_id, status = ticket
+    try:
+        if message.text:
+            await bot.send_message(user_id, f"💬 <b>Ответ от поддержки:</b>\n\n{message.text}")
         else:
-             await message.answer("Не удалось извлечь ID пользователя из сообщения.")
+            # Фото, документ, голосовое и т.п. — копией сообщения, с подписью, если она была
+            await bot.send_message(user_id, "💬 <b>Ответ от поддержки:</b>")
+            await bot.copy_message(user_id, message.chat.id, message.message_id)
+    except Exception as e:
+        logger.error(f"Не удалось отправить ответ на тикет #{ticket_id} пользователю {user_id}: {e}")
+        if is_unreachable(e):
+            await known_users.mark_blocked([user_id])
+        await message.answer(f"❌ Не удалось отправить ответ пользователю {user_id}. Возможно, он заблокировал бота.")
+        return
+    await db.mark_ticket_answered(ticket_id, message.from_user.id)
+    note = "" if status == 'open' else " (тикет уже был отвечен ранее)"
+    await message.answer(f"✅ Ваш ответ на тикет #{ticket_id} успешно отправлен пользователю{note}.")
+
+@router.message(Command("tickets"))
+@router.message(F.text == "💬 Открытые тикеты")
+async def open_tickets_handler(message: Message):
+    """Список самых старых открытых тикетов."""
+    tickets, total = await db.get_open_tickets(limit=20)
+    if not tickets:
+        await message.answer("Открытых тикетов нет.")
+        return
+    lines = [f"<b>Открытые тикеты: {total}</b>\n"]
+    for ticket_id, user_id, question, created_at in tickets:
+        preview = (question or "(вложение)").replace("\n", " ")
+        if len(preview) > 60:
+            preview = preview[:60] + "…"
+        created = datetime.fromtimestamp(created_at).strftime("%d.%m %H:%M")
+        lines.append(f"#{ticket_id} · {created} · <code>{user_id}</code>\n{escape(preview)}")
+    if total > len(tickets):
+        lines.append(f"\n…и еще {total - len(tickets)}")
+    await message.answer("\n".join(lines))
 
 @router.message(Command("admin"))
 async def admin_panel(message: Message, state: FSMContext):
     await state.clear()
     await message.answer("Добро пожаловать в админ-панель!", reply_markup=kb.get_admin_panel())
 
+@router.message(Command("dbstats"))
+async def db_profile_handler(message: Message):
+    """Сводка профилирования запросов к БД (при DB_PROFILE=1)."""
+    if not dbprofile.is_enabled():
+        await message.answer("Профилирование БД выключено. Укажите DB_PROFILE=1 в .env и перезапустите бота.")
+        return
+    await message.answer(f"<pre>{dbprofile.summary(limit=25)}</pre>")
+
+@router.message(Command("export"))
+async def export_handler(message: Message, command: CommandObject):
+    """Выгрузка платежей или пользователей сжатым CSV/JSONL-файлом."""
+    try:
+        request = export.ExportRequest.parse(command.args)
+    except ValueError as e:
+        await message.answer(str(e))
+        return
+    if export.is_running():
+        await message.answer("⏳ Уже идет другая выгрузка, попробуйте через минуту.")
+        return
+    status = await message.answer("⏳ Готовлю выгрузку...")
+    path = None
+    try:
+        path, count = await export.export_to_file(request)
+        if os.path.getsize(path) > export.MAX_DOCUMENT_SIZE:
+            await status.edit_text("❌ Файл получился больше 50 МБ — Telegram его не примет. Сузьте период или укажите тариф.")
+            return
+        caption = f"Строк: {count}"
+        if request.tariff_name:
+            caption += f", тариф: {escape(request.tariff_name)}"
+        await message.answer_document(FSInputFile(path, filename=request.filename), caption=caption)
+        await status.delete()
+    except Exception as e:
+        logger.error(f"Не удалось выгрузить {request.filename}: {e}")
+        try:
+            await status.edit_text("❌ Не удалось подготовить выгрузку. Подробности в логе бота.")
+        except Exception:
+            pass
+    finally:
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
 @router.message(F.text == "❌ Отмена")
 async def cancel_handler(message: Message, state: FSMContext):
     # Добавили проверку, чтобы кнопка Отмена не срабатывала в главном меню
@@ -115,6 +192,8 @@ async def cancel_handler(message: Message, state: FSMContext):
 async def get_stats_handler(message: Message):
     # Статистика по пользователям
     total_users, active_subs = await db.get_stats()
+    channel_id = await get_channel_id()
+    unpaid_members = await db.count_unpaid_members(channel_id) if channel_id else 0
     
     # Финансовая статистика
     today_revenue, today_sales = await db.get_sales_for_period(days=1)
@@ -133,7 +212,8 @@ async def get_stats_handler(message: Message):
         f"📊 <b>Статистика бота</b>\n\n"
         f"<b>Пользователи:</b>\n"
         f"  - Всего: <code>{total_users}</code>\n"
-        f"  - Активных подписок: <code>{active_subs}</code>\n\n"
+        f"  - Активных подписок: <code>{active_subs}</code>\n"
+        f"  - В канале без подписки: <code>{unpaid_members}</code>\n\n"
         f"<b>Финансы:</b>\n"
         f"  - <b>За сегодня:</b> {today_revenue} RUB ({today_sales} продаж)\n"
         f"  - <b>За 7 дней:</b> {week_revenue} RUB ({week_sales} продаж)\n"
@@ -145,48 +225,118 @@ async def get_stats_handler(message: Message):
     await message.answer(stats_text)
 
 
+USERS_PAGE_SIZE = 10
+
 @router.message(F.text == "👥 Пользователи")
 async def find_user_start(message: Message, state: FSMContext):
-    """Начинает процесс поиска пользователя по ID."""
+    """Начинает поиск пользователя по ID или username и предлагает списки по фильтрам."""
     await state.set_state(AdminStates.find_user_id)
-    await message.answer("Введите Telegram ID пользователя для управления:", reply_markup=kb.get_cancel_kb())
+    await message.answer(
+        "Введите Telegram ID пользователя или начало его username для поиска:", reply_markup=kb.get_cancel_kb()
+    )
+    await message.answer("Или откройте список пользователей:", reply_markup=kb.get_user_filters_kb())
 
 @router.message(AdminStates.find_user_id)
 async def find_user_process(message: Message, state: FSMContext):
-    """Обрабатывает введенный ID и показывает карточку пользователя."""
-    if not message.text.isdigit():
-        await message.answer("Ошибка: ID пользователя должен быть числом. Попробуйте еще раз.")
+    """Обрабатывает введенный ID (карточка пользователя) или начало username (страница поиска)."""
+    text = (message.text or "").strip()
+    if not text.isdigit():
+        query = text.lstrip("@")
+        if not query or not query.isascii() or not query.replace("_", "").isalnum():
+            await message.answer("Введите числовой ID или начало username (латиница, цифры и _). Попробуйте еще раз.")
+            return
+        await state.clear()
+        # Запрос не помещается в callback_data вместе с курсором, поэтому хранится в данных FSM
+        await state.update_data(users_query=query)
+        page_text, markup = await _users_page('search', None, False, query)
+        await message.answer(page_text, reply_markup=markup)
         return
-    
-    user_id = int(message.text)
-    user_data = await db.get_user_profile(user_id)
-    
-    if not user_data:
-        await message.answer(f"Пользователь с ID <code>{user_id}</code> не найден в базе данных.", reply_markup=kb.get_admin_panel())
+
+    profile = await _user_card(int(text))
+    if profile is None:
+        await message.answer(f"Пользователь с ID <code>{text}</code> не найден в базе данных.", reply_markup=kb.get_admin_panel())
         await state.clear()
         return
+    await message.answer(profile, reply_markup=kb.get_user_management_kb(int(text)))
+    await state.clear()
+
+@router.callback_query(F.data.startswith("users:"))
+async def users_page_handler(callback: CallbackQuery, state: FSMContext):
+    """Страница списка пользователей: users:<фильтр>:<n|p>[:<ключ>:<user_id>]."""
+    _, filter_name, direction, *cursor = callback.data.split(":", 4)
+    query = None
+    if filter_name == 'search':
+        query = (await state.get_data()).get("users_query")
+        if not query:
+            await callback.answer("Поиск устарел, введите запрос заново.", show_alert=True)
+            return
+    if cursor:
+        key, user_id = cursor
+        cursor = (key if filter_name == 'search' else int(key), int(user_id))
+    page_text, markup = await _users_page(filter_name, cursor or None, direction == "p", query)
+    await callback.message.edit_text(page_text, reply_markup=markup)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("user_card:"))
+async def user_card_handler(callback: CallbackQuery):
+    user_id = int(callback.data.split(':')[1])
+    profile = await _user_card(user_id)
+    if profile is None:
+        await callback.answer("Пользователь не найден.", show_alert=True)
+        return
+    await callback.message.answer(profile, reply_markup=kb.get_user_management_kb(user_id))
+    await callback.answer()
+
+async def _users_page(filter_name, cursor, backward, query=None):
+    """Текст и клавиатура страницы списка; курсоры соседних страниц — по крайним строкам текущей."""
+    rows = await db.browse_users(filter_name, cursor, backward, USERS_PAGE_SIZE, query)
+    has_more = len(rows) > USERS_PAGE_SIZE
+    if backward:
+        rows = rows[-USERS_PAGE_SIZE:]
+        has_prev, has_next = has_more, True
+    else:
+        rows = rows[:USERS_PAGE_SIZE]
+        has_prev, has_next = cursor is not None, has_more
+    prev_cursor = (rows[0][4], rows[0][0]) if has_prev and rows else None
+    next_cursor = (rows[-1][4], rows[-1][0]) if has_next and rows else None
+
+    title = f"Поиск «{escape(query)}»" if filter_name == 'search' else kb.USER_FILTER_TITLES[filter_name]
+    lines = [f"<b>👥 {title}</b>\n"]
+    now = datetime.now()
+    for user_id, username, sub_end, blocked_at, _ in rows:
+        if blocked_at:
+            status = "⛔ заблокировал бота"
+        elif sub_end and datetime.fromtimestamp(sub_end) > now:
+            status = f"✅ до {datetime.fromtimestamp(sub_end).strftime('%d.%m.%Y')}"
+        else:
+            status = "❌ нет подписки"
+        lines.append(f"<code>{user_id}</code> @{username or '—'} · {status}")
+    if not rows:
+        lines.append("Никого не найдено.")
+    return "\n".join(lines), kb.get_users_page_kb(rows, filter_name, prev_cursor, next_cursor)
+
+async def _user_card(user_id):
+    """Текст карточки пользователя или None, если его нет в базе."""
+    user_data = await db.get_user_profile(user_id)
+    if not user_data:
+        return None
 
     # Формируем "карточку" пользователя
-    user_id, username, sub_end_str = user_data
+    user_id, username, sub_end = user_data
     profile_text = (
         f"👤 <b>Профиль пользователя</b>\n\n"
         f"<b>ID:</b> <code>{user_id}</code>\n"
         f"<b>Username:</b> @{username if username else 'не указан'}\n"
     )
-    if sub_end_str:
-        end_date = datetime.strptime(sub_end_str, "%Y-%m-%d %H:%M:%S")
+    if sub_end:
+        end_date = datetime.fromtimestamp(sub_end)
         if end_date > datetime.now():
             profile_text += f"<b>Статус подписки:</b> ✅ Активна до {end_date.strftime('%d.%m.%Y %H:%M')}"
         else:
             profile_text += f"<b>Статус подписки:</b> ❌ Истекла {end_date.strftime('%d.%m.%Y %H:%M')}"
     else:
         profile_text += "<b>Статус подписки:</b> ❌ Отсутствует"
-
-    await message.answer(
-        profile_text,
-        reply_markup=kb.get_user_management_kb(user_id)
-    )
-    await state.clear()
+    return profile_text
 
 
 @router.callback_query(F.data.startswith("extend_sub:"))
@@ -263,30 +413,17 @@ async def confirm_broadcast(message: Message, state: FSMContext, bot: Bot):
     text = data.get('text')
     photo_id = data.get('photo')
     await state.clear()
-    user_ids = await db.get_all_user_ids()
-    await message.answer(f"Начинаю рассылку для {len(user_ids)} пользователей...", reply_markup=kb.get_admin_panel())
-    success = 0
-    errors = 0
-    for user_id in user_ids:
-        try:
-            if photo_id:
-                await bot.send_photo(user_id, photo_id, caption=text)
-            else:
-                await bot.send_message(user_id, text)
-            success += 1
-        except Exception:
-            errors += 1
-        await asyncio.sleep(0.1)
-    await message.answer(f"✅ Рассылка завершена!\n\nОтправлено: {success}\nОшибок: {errors}")
+    await message.answer("Рассылка запущена в фоне. Прогресс будет обновляться в сообщении ниже.", reply_markup=kb.get_admin_panel())
+    await broadcast.start_broadcast(bot, message.chat.id, text, photo_id)
 @router.message(F.text == "⚙️ Управление тарифами")
 async def manage_tariffs(message: Message):
-    await message.answer("Выберите действие:", reply_markup=await kb.get_manage_tariffs_kb())
+    await message.answer("Выберите действие:", reply_markup=catalog.manage_menu)
 @router.callback_query(F.data.startswith('delete_tariff:'))
 async def delete_tariff_handler(callback: CallbackQuery):
     tariff_id = int(callback.data.split(':')[1])
-    await db.delete_tariff(tariff_id)
+    await catalog.delete(tariff_id)
     await callback.answer("Тариф удален!")
-    await callback.message.edit_reply_markup(reply_markup=await kb.get_manage_tariffs_kb())
+    await callback.message.edit_reply_markup(reply_markup=catalog.manage_menu)
 @router.callback_query(F.data == 'add_tariff')
 async def add_tariff_start(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AdminStates.add_tariff_name)
@@ -311,7 +448,7 @@ async def add_tariff_duration(message: Message, state: FSMContext):
         await message.answer("Пожалуйста, введите корректный срок (только цифры).")
         return
     data = await state.get_data()
-    await db.add_tariff(data['name'], data['price'], int(message.text))
+    await catalog.add(data['name'], data['price'], int(message.text))
     await state.clear()
     await message.answer("✅ Новый тариф успешно добавлен!", reply_markup=kb.get_admin_panel())
 @router.message(F.text == "🔄 Сменить канал")
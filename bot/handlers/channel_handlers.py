@@ -0,0 +1,64 @@
+# handlers/channel_handlers.py
+import logging
+import time
+from aiogram import Router, Bot
+from aiogram.filters import ChatMemberUpdatedFilter, JOIN_TRANSITION, LEAVE_TRANSITION
+from aiogram.types import ChatJoinRequest, ChatMemberUpdated
+
+import database as db
+import metrics
+from invites import get_channel_id
+
+# Обновления приходят от Telegram сами (бот должен быть администратором канала);
+# chat_member и chat_join_request попадают в allowed_updates автоматически, как только есть обработчики
+router = Router()
+logger = logging.getLogger(__name__)
+
+
+@router.chat_member(ChatMemberUpdatedFilter(JOIN_TRANSITION))
+async def member_joined(event: ChatMemberUpdated, bot: Bot):
+    """Отмечает вступление в канал, отзывает использованную ссылку и помечает вступивших без подписки."""
+    channel_id = await get_channel_id()
+    if event.chat.id != channel_id:
+        return
+    user = event.new_chat_member.user
+    invite_link = event.invite_link
+    subscribed = await db.record_channel_join(channel_id, user.id, invite_link.invite_link if invite_link else None)
+    metrics.channel_events.inc(event="join")
+    if not subscribed:
+        metrics.channel_events.inc(event="join_unpaid")
+        logger.warning(f"Пользователь {user.id} (@{user.username}) вступил в канал без активной подписки.")
+
+    # Одноразовая ссылка бота свою задачу выполнила — отзываем ее, чтобы ею нельзя было поделиться повторно
+    if invite_link and invite_link.creator.id == bot.id and not invite_link.is_revoked:
+        try:
+            await bot.revoke_chat_invite_link(chat_id=channel_id, invite_link=invite_link.invite_link)
+        except Exception as e:
+            logger.warning(f"Не удалось отозвать ссылку {invite_link.invite_link}: {e}")
+
+
+@router.chat_member(ChatMemberUpdatedFilter(LEAVE_TRANSITION))
+async def member_left(event: ChatMemberUpdated):
+    """Отмечает выход из канала (сам или после кика) — повторный кик такому пользователю не нужен."""
+    channel_id = await get_channel_id()
+    if event.chat.id != channel_id:
+        return
+    await db.record_channel_leave(channel_id, event.new_chat_member.user.id)
+    metrics.channel_events.inc(event="leave")
+
+
+@router.chat_join_request()
+async def join_request(request: ChatJoinRequest, bot: Bot):
+    """Заявки на вступление (ссылки с одобрением): пускаем только с активной подпиской."""
+    channel_id = await get_channel_id()
+    if request.chat.id != channel_id:
+        return
+    user_id = request.from_user.id
+    end_date = await db.get_user_subscription(user_id)
+    if end_date and end_date > time.time():
+        await bot.approve_chat_join_request(chat_id=channel_id, user_id=user_id)
+        metrics.channel_events.inc(event="join_request_approved")
+    else:
+        await bot.decline_chat_join_request(chat_id=channel_id, user_id=user_id)
+        metrics.channel_events.inc(event="join_request_declined")
+        logger.info(f"Заявка пользователя {user_id} на вступление в канал отклонена: нет активной подписки.")
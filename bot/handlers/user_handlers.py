@@ -1,8 +1,9 @@
 # handlers/user_handlers.py
-import time
+import asyncio
 import logging
 import math
 from datetime import datetime
+from html import escape
 from aiogram import Router, F, Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import CommandStart
@@ -11,7 +12,12 @@ from aiogram.types import Message, CallbackQuery, LabeledPrice, PreCheckoutQuery
 import database as db
 import keyboards as kb
 from config import PAYMENT_PROVIDER_TOKEN, ADMIN_IDS
+from invites import get_channel_id, invite_pool
+from known_users import known_users
+from outbox import PAYMENT
+from promos import promo_index
 from states import SupportStates, UserPromoStates
+from tariffs import catalog
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -22,7 +28,7 @@ logger = logging.getLogger(__name__)
 async def cmd_start(message: Message, state: FSMContext):
     """Обработчик команды /start."""
     await state.clear()
-    await db.add_user(message.from_user.id, message.from_user.username)
+    await known_users.add(message.from_user.id, message.from_user.username)
     
     welcome_photo_id = await db.get_setting('welcome_photo_id')
     about_text = await db.get_setting('about_text')
@@ -56,7 +62,7 @@ async def info_handler(message: Message):
 
 @router.message(F.text == "💳 Оплата")
 async def payment_handler(message: Message):
-    tariffs_kb = await kb.get_payment_menu()
+    tariffs_kb = catalog.payment_menu
     if not tariffs_kb.inline_keyboard:
          await message.answer("К сожалению, на данный момент нет доступных тарифов.")
          return
@@ -66,12 +72,12 @@ async def payment_handler(message: Message):
 @router.message(F.text == "👤 Мой профиль")
 async def profile_handler(message: Message):
     user_id = message.from_user.id
-    subscription_end_str = await db.get_user_subscription(user_id)
+    subscription_end = await db.get_user_subscription(user_id)
     
     profile_text = f"👤 <b>Ваш профиль</b>\n\n<b>ID:</b> <code>{user_id}</code>\n"
     
-    if subscription_end_str:
-        end_date = datetime.strptime(subscription_end_str, "%Y-%m-%d %H:%M:%S")
+    if subscription_end:
+        end_date = datetime.fromtimestamp(subscription_end)
         if end_date > datetime.now():
             formatted_date = end_date.strftime("%d.%m.%Y в %H:%M")
             profile_text += f"<b>Статус подписки:</b> ✅ Активна до {formatted_date}"
@@ -97,19 +103,31 @@ async def support_request(message: Message, state: FSMContext):
 @router.message(SupportStates.awaiting_question)
 async def process_question(message: Message, state: FSMContext, bot: Bot):
     user = message.from_user
+    question = message.text or message.caption
+    ticket_id = await db.create_ticket(user.id, question)
     ticket_text = (
-        f"<b>❗️ Новый вопрос в поддержку</b>\n\n"
+        f"<b>❗️ Новый вопрос в поддержку #{ticket_id}</b>\n\n"
         f"<b>От пользователя:</b> {user.full_name}\n"
         f"<b>Username:</b> @{user.username if user.username else 'не указан'}\n"
         f"<b>User ID:</b> <code>{user.id}</code>\n\n"
-        f"<b>Текст вопроса:</b>\n{message.text}"
+        f"<b>Текст вопроса:</b>\n{escape(question) if question else '(вложение ниже)'}\n\n"
+        f"<i>Ответьте на это сообщение, чтобы ответить пользователю.</i>"
     )
 
-    for admin_id in ADMIN_IDS:
+    async def send_to_admin(admin_id):
         try:
-            await bot.send_message(admin_id, ticket_text)
+            sent = [await bot.send_message(admin_id, ticket_text)]
+            # Фото, документы и голосовые пересылаем копией: на нее тоже можно ответить
+            if not message.text:
+                sent.append(await bot.copy_message(admin_id, message.chat.id, message.message_id))
+            return [(admin_id, m.message_id) for m in sent]
         except Exception as e:
-            logger.error(f"Не удалось отправить тикет админу {admin_id}: {e}")
+            logger.error(f"Не удалось отправить тикет #{ticket_id} админу {admin_id}: {e}")
+            return []
+
+    # Админам рассылаем одновременно; ответ на любое из сообщений находит тикет по таблице ticket_messages
+    results = await asyncio.gather(*(send_to_admin(admin_id) for admin_id in ADMIN_IDS))
+    await db.add_ticket_messages(ticket_id, [item for sent in results for item in sent])
 
     await message.answer(
         "✅ Спасибо! Ваш вопрос был отправлен администраторам. Они ответят вам в ближайшее время.",
@@ -123,7 +141,7 @@ async def process_question(message: Message, state: FSMContext, bot: Bot):
 @router.callback_query(F.data.startswith("pay:"))
 async def select_tariff(callback: CallbackQuery, state: FSMContext):
     tariff_id = int(callback.data.split(':')[1])
-    tariff_details = await db.get_tariff_details(tariff_id)
+    tariff_details = catalog.get(tariff_id)
     if not tariff_details:
         await callback.answer("Тариф не найден.", show_alert=True)
         return
@@ -154,13 +172,12 @@ async def process_promo_code(message: Message, state: FSMContext):
     data = await state.get_data()
     tariff_id = data.get('tariff_id')
     
-    promo_details = await db.get_promo_code_details(user_code)
-    tariff_details = await db.get_tariff_details(tariff_id)
+    tariff_details = catalog.get(tariff_id)
     
     tariff_name, price, duration = tariff_details
 
-    if promo_details and promo_details[4] and promo_details[3] < promo_details[2]:
-        discount = promo_details[1]
+    if promo_index.is_available(user_code):
+        discount = promo_index.get(user_code).discount
         new_price = math.ceil(price * (1 - discount / 100))
         final_price = max(1, new_price)
 
@@ -178,13 +195,13 @@ async def process_promo_code(message: Message, state: FSMContext):
         await message.answer(text, reply_markup=kb.get_pre_payment_kb(tariff_id))
 
 
-@router.callback_query(F.data.startswith("final_pay:"))
+@router.callback_query(F.data.startswith("final_pay:"), flags={"lane": PAYMENT})
 async def create_final_invoice(callback: CallbackQuery, bot: Bot):
     try:
         _, tariff_id_str, promo_code = callback.data.split(':')
         tariff_id = int(tariff_id_str)
         
-        tariff_details = await db.get_tariff_details(tariff_id)
+        tariff_details = catalog.get(tariff_id)
         if not tariff_details:
             await callback.answer("Тариф не найден.", show_alert=True)
             return
@@ -192,80 +209,98 @@ async def create_final_invoice(callback: CallbackQuery, bot: Bot):
         tariff_name, price, duration = tariff_details
         final_price = price
 
+        # Использование промокода резервируется за пользователем до оплаты, чтобы лимит нельзя было превысить
+        reservation = None
         if promo_code != 'no_promo':
-            promo_details = await db.get_promo_code_details(promo_code)
-            if promo_details and promo_details[4] and promo_details[3] < promo_details[2]:
-                discount = promo_details[1]
+            reservation = promo_index.reserve(promo_code, callback.from_user.id)
+            if reservation:
+                discount = promo_index.get(promo_code).discount
                 new_price = math.ceil(price * (1 - discount / 100))
                 final_price = max(1, new_price)
             else:
                 promo_code = 'no_promo'
         
-        payload_data = f"sub:{callback.from_user.id}:{tariff_id}:{final_price}:{duration}:{promo_code}"
-
-        await bot.send_invoice(
-            chat_id=callback.from_user.id,
-            title=f"Оформление подписки «{tariff_name}»",
-            description=f"Доступ к каналу на {duration} дней.",
-            payload=payload_data,
-            provider_token=PAYMENT_PROVIDER_TOKEN,
-            currency="RUB",
-            prices=[LabeledPrice(label=f"Подписка «{tariff_name}»", amount=final_price * 100)],
-        )
+        payload_data = f"sub:{callback.from_user.id}:{tariff_id}:{final_price}:{duration}:{promo_code}:{reservation or '-'}"
+
+        try:
+            await bot.send_invoice(
+                chat_id=callback.from_user.id,
+                title=f"Оформление подписки «{tariff_name}»",
+                description=f"Доступ к каналу на {duration} дней.",
+                payload=payload_data,
+                provider_token=PAYMENT_PROVIDER_TOKEN,
+                currency="RUB",
+                prices=[LabeledPrice(label=f"Подписка «{tariff_name}»", amount=final_price * 100)],
+            )
+        except Exception:
+            if reservation:
+                promo_index.release(reservation)
+            raise
         await callback.message.delete()
     except Exception as e:
         logger.error(f"Ошибка при создании финального инвойса для {callback.from_user.id}: {e}")
         await callback.answer("Произошла ошибка. Попробуйте снова.", show_alert=True)
 
 
+def parse_payload(payload):
+    """Разбирает payload счета: (user_id, tariff_id, price, days, promo_code, reservation).
+
+    Счета, выставленные до появления резервов промокодов, содержат на одно поле меньше.
+    """
+    parts = payload.split(':')
+    _, user_id_str, tariff_id_str, price_str, duration_str, promo_code = parts[:6]
+    reservation = parts[6] if len(parts) > 6 and parts[6] != '-' else None
+    promo_code = promo_code if promo_code != 'no_promo' else None
+    return int(user_id_str), int(tariff_id_str), int(price_str), int(duration_str), promo_code, reservation
+
+
 @router.pre_checkout_query()
 async def pre_checkout_query(pre_checkout_q: PreCheckoutQuery, bot: Bot):
+    user_id, _, _, _, promo_code, reservation = parse_payload(pre_checkout_q.invoice_payload)
+    if promo_code and not promo_index.confirm(reservation or f"legacy-{user_id}", promo_code, user_id):
+        await bot.answer_pre_checkout_query(
+            pre_checkout_q.id, ok=False,
+            error_message="Лимит использований промокода исчерпан. Пожалуйста, оформите оплату заново."
+        )
+        return
     await bot.answer_pre_checkout_query(pre_checkout_q.id, ok=True)
 
 
-@router.message(F.successful_payment)
+@router.message(F.successful_payment, flags={"lane": PAYMENT, "throttle": False})
 async def successful_payment(message: Message, bot: Bot):
     try:
         telegram_payment_id = message.successful_payment.telegram_payment_charge_id
         
-        _, user_id_str, tariff_id_str, price_str, duration_str, promo_code = message.successful_payment.invoice_payload.split(':')
-        
-        user_id = int(user_id_str)
-        tariff_id = int(tariff_id_str)
-        price = int(price_str)
-        days = int(duration_str)
+        user_id, tariff_id, price, days, promo_code, reservation = parse_payload(message.successful_payment.invoice_payload)
 
-        if promo_code != 'no_promo':
-            await db.increment_promo_code_use(promo_code)
-
-        tariff_details = await db.get_tariff_details(tariff_id)
+        tariff_details = catalog.get(tariff_id)
         tariff_name = tariff_details[0] if tariff_details else "Неизвестный тариф"
-        
-        await db.add_payment_record(user_id, tariff_name, price, days, telegram_payment_id)
-        
-        # --- ИЗМЕНЕНИЕ ЗДЕСЬ: Используем "умную" функцию и сообщаем новую дату ---
-        new_end_date = await db.update_subscription(user_id, days)
+
+        # Платеж, промокод и продление подписки применяются одной транзакцией
+        new_end_date = await db.apply_payment(
+            user_id, tariff_name, price, days, telegram_payment_id, promo_code=promo_code
+        )
+        if new_end_date is None:
+            logger.warning(f"Платеж {telegram_payment_id} пользователя {user_id} уже был обработан, повтор пропущен.")
+            return
+        if promo_code:
+            promo_index.commit(reservation or f"legacy-{user_id}", promo_code)
         formatted_date = new_end_date.strftime("%d.%m.%Y в %H:%M")
         
         await message.answer(
             f"✅ Оплата прошла успешно! Ваша подписка обновлена и теперь активна до <b>{formatted_date}</b>."
         )
         
-        channel_id = await db.get_setting('channel_id')
-        if not channel_id or not channel_id.replace('-', '').isdigit():
+        channel_id = await get_channel_id()
+        if channel_id is None:
             logger.warning(f"Невозможно отправить ссылку пользователю {user_id}: ID канала не настроен.")
             await message.answer("Ваша подписка активирована, но произошла ошибка с отправкой ссылки. Пожалуйста, обратитесь к администратору.")
             return
 
-        expire_date = int(time.time()) + 3600
-        invite_link = await bot.create_chat_invite_link(
-            chat_id=int(channel_id),
-            expire_date=expire_date,
-            member_limit=1,
-            name=f"Для {message.from_user.id}"
-        )
+        # Ссылка берется из заранее созданного пула; запрос к Telegram — только если пул пуст
+        invite_link, link_expires = await invite_pool.claim(bot, channel_id, message.from_user.id)
         await message.answer(
-            f"Вот ваша уникальная ссылка для входа в канал (действует 1 час):\n{invite_link.invite_link}",
+            f"Вот ваша уникальная ссылка для входа в канал (действует до {link_expires.strftime('%d.%m.%Y %H:%M')}):\n{invite_link}",
             reply_markup=None
         )
     except Exception as e:
@@ -0,0 +1,132 @@
+# invites.py
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from aiogram import Bot
+
+import database as db
+import metrics
+from outbox import REMINDER, lane
+
+logger = logging.getLogger(__name__)
+
+# Выданная ссылка должна действовать хотя бы час: более старые ссылки пула заменяются новыми
+MIN_LIFETIME = 3600
+
+
+async def get_channel_id():
+    """ID канала из настроек или None, если он не задан или некорректен."""
+    channel_id = await db.get_setting('channel_id')
+    if not channel_id or not channel_id.replace('-', '').isdigit():
+        return None
+    return int(channel_id)
+
+
+class InvitePool:
+    """Пул заранее созданных одноразовых (member_limit=1) ссылок в канал.
+
+    Ссылки хранятся в таблице invite_links и выдаются по одной на оплату атомарным UPDATE,
+    так что пользователь получает ссылку без запроса к Telegram. Фоновая задача раз в
+    `refill_interval` секунд (и сразу после каждой выдачи) удаляет ссылки, которым осталось
+    меньше MIN_LIFETIME, и досоздает пул до `size` в полосе напоминаний outbox. Если пул пуст,
+    ссылка создается на месте, как раньше.
+    """
+
+    def __init__(self, size: int = 20, link_ttl: int = 86400, refill_interval: float = 60):
+        self.size = size
+        self.link_ttl = link_ttl
+        self.refill_interval = refill_interval
+        self._bot = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self, bot: Bot, size: int = None, link_ttl: int = None, refill_interval: float = None):
+        self._bot = bot
+        self.size = size if size is not None else self.size
+        self.link_ttl = link_ttl if link_ttl is not None else self.link_ttl
+        self.refill_interval = refill_interval if refill_interval is not None else self.refill_interval
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def claim(self, bot: Bot, channel_id: int, user_id: int):
+        """Ссылка для пользователя после оплаты: (invite_link, datetime окончания действия)."""
+        row = await db.claim_invite_link(channel_id, user_id, int(time.time()) + MIN_LIFETIME)
+        self._wakeup.set()
+        if row:
+            metrics.invite_links.inc(source="pool")
+            metrics.invite_pool_size.dec()
+            link, expire_date = row
+            return link, datetime.fromtimestamp(expire_date)
+        metrics.invite_links.inc(source="created")
+        logger.warning(f"Пул ссылок пуст, создаю ссылку для пользователя {user_id} на месте.")
+        expire_date = int(time.time()) + MIN_LIFETIME
+        invite_link = await bot.create_chat_invite_link(
+            chat_id=channel_id,
+            expire_date=expire_date,
+            member_limit=1,
+            name=f"Для {user_id}"
+        )
+        return invite_link.invite_link, datetime.fromtimestamp(expire_date)
+
+    async def refill(self):
+        """Удаляет устаревающие ссылки и досоздает пул. Возвращает число созданных ссылок."""
+        channel_id = await get_channel_id()
+        if channel_id is None:
+            return 0
+        min_expire = int(time.time()) + MIN_LIFETIME
+        await self._revoke_foreign(channel_id)
+        await db.delete_stale_invite_links(channel_id, min_expire)
+        free = await db.count_free_invite_links(channel_id, min_expire)
+        created = []
+        try:
+            with lane(REMINDER):
+                for _ in range(self.size - free):
+                    expire_date = int(time.time()) + self.link_ttl
+                    invite_link = await self._bot.create_chat_invite_link(
+                        chat_id=channel_id, expire_date=expire_date, member_limit=1, name="Подписка"
+                    )
+                    created.append((invite_link.invite_link, expire_date))
+        finally:
+            # Уже созданные ссылки сохраняем, даже если Telegram отказал на середине
+            if created:
+                await db.add_invite_links(channel_id, created)
+            metrics.invite_pool_size.set(free + len(created))
+        return len(created)
+
+    async def _revoke_foreign(self, channel_id):
+        # После смены канала неиспользованные ссылки в прежний остаются рабочими в Telegram до истечения
+        # срока — отзываем их перед удалением из пула; бот мог уже потерять права в том канале
+        links = await db.get_foreign_invite_links(channel_id)
+        with lane(REMINDER):
+            for old_channel_id, invite_link in links:
+                try:
+                    await self._bot.revoke_chat_invite_link(chat_id=old_channel_id, invite_link=invite_link)
+                except Exception as e:
+                    logger.warning(f"Не удалось отозвать ссылку {invite_link} в канал {old_channel_id}: {e}")
+        if links:
+            logger.info(f"Отозвано {len(links)} неиспользованных ссылок в прежний канал.")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.refill()
+            except Exception as e:
+                logger.error(f"Не удалось пополнить пул ссылок в канал: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+invite_pool = InvitePool()
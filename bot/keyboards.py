@@ -1,6 +1,5 @@
 # keyboards.py
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
-import database as db
 
 def get_cancel_kb():
     builder = ReplyKeyboardBuilder()
@@ -16,9 +15,8 @@ def get_main_menu():
     builder.adjust(2, 2)
     return builder.as_markup(resize_keyboard=True)
 
-async def get_payment_menu():
+def get_payment_menu(tariffs):
     builder = InlineKeyboardBuilder()
-    tariffs = await db.get_all_tariffs()
     for tariff in tariffs:
         builder.button(text=f"{tariff[1]} - {tariff[2]} RUB ({tariff[3]} дн.)", callback_data=f"pay:{tariff[0]}")
     builder.adjust(1)
@@ -51,6 +49,7 @@ def get_admin_panel():
     builder.button(text="🔄 Сменить канал")
     builder.button(text="🖼️ Сменить фото приветствия")
     builder.button(text="📝 Изменить текст 'О канале'")
+    builder.button(text="💬 Открытые тикеты")
     builder.adjust(2)
     return builder.as_markup(resize_keyboard=True)
 
@@ -61,11 +60,42 @@ def get_user_management_kb(user_id: int):
     builder.adjust(1)
     return builder.as_markup()
 
+# --- Список пользователей в админке ---
+USER_FILTER_TITLES = {
+    'all': "Все",
+    'active': "✅ Активные",
+    'expired': "⌛ Истекшие",
+    'never_paid': "🆕 Не платили",
+    'blocked': "⛔ Заблокировали бота",
+}
+
+def get_user_filters_kb():
+    builder = InlineKeyboardBuilder()
+    for filter_name, title in USER_FILTER_TITLES.items():
+        builder.button(text=title, callback_data=f"users:{filter_name}:n")
+    builder.adjust(2)
+    return builder.as_markup()
+
+def get_users_page_kb(rows, filter_name, prev_cursor=None, next_cursor=None):
+    """Кнопка на каждого пользователя страницы и навигация; курсор — (ключ сортировки, user_id)."""
+    builder = InlineKeyboardBuilder()
+    for user_id, username, *_ in rows:
+        builder.button(text=f"👤 {user_id} @{username or '—'}", callback_data=f"user_card:{user_id}")
+    nav = []
+    if prev_cursor:
+        nav.append(("◀️ Назад", f"users:{filter_name}:p:{prev_cursor[0]}:{prev_cursor[1]}"))
+        nav.append(("⏮ В начало", f"users:{filter_name}:n"))
+    if next_cursor:
+        nav.append(("Далее ▶️", f"users:{filter_name}:n:{next_cursor[0]}:{next_cursor[1]}"))
+    for text, data in nav:
+        builder.button(text=text, callback_data=data)
+    builder.adjust(*([1] * len(rows)), len(nav) or 1)
+    return builder.as_markup()
+
 # --- НОВАЯ КЛАВИАТУРА: Управление промокодами ---
-async def get_promo_codes_management_kb():
+def get_promo_codes_management_kb(all_codes):
     builder = InlineKeyboardBuilder()
     builder.button(text="➕ Создать новый промокод", callback_data="create_promo")
-    all_codes = await db.get_all_promo_codes()
     for code in all_codes:
         promo_id, code_text, discount, uses, max_uses, is_active = code
         status_emoji = "✅" if is_active else "❌"
@@ -77,10 +107,9 @@ async def get_promo_codes_management_kb():
     builder.adjust(1)
     return builder.as_markup()
 
-async def get_manage_tariffs_kb():
+def get_manage_tariffs_kb(tariffs):
     builder = InlineKeyboardBuilder()
     builder.button(text="➕ Добавить новый тариф", callback_data="add_tariff")
-    tariffs = await db.get_all_tariffs()
     for tariff in tariffs:
         builder.button(text=f"❌ Удалить: {tariff[1]} ({tariff[2]} RUB)", callback_data=f"delete_tariff:{tariff[0]}")
     builder.adjust(1)
@@ -0,0 +1,91 @@
+# kicker.py
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+
+from known_users import is_unreachable, known_users
+from outbox import REMINDER, lane
+
+logger = logging.getLogger(__name__)
+
+EXPIRED_TEXT = "Срок вашей подписки на канал истёк. Вы можете оформить её заново в меню 'Оплата'."
+
+
+class KickReport:
+    """Итоги одного прогона кика: сколько удалено, уведомлено, ошибок и за какое время.
+
+    `blocked` — пользователи, у которых в этом прогоне выяснилось, что они заблокировали бота;
+    `skipped_notify` — уже известные как заблокировавшие: им уведомление не отправлялось;
+    `absent` — уже вышедшие из канала: их не баним, только уведомляем.
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.kicked = 0
+        self.notified = 0
+        self.failed = 0
+        self.blocked = []
+        self.skipped_notify = []
+        self.absent = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"удалено {self.kicked}/{self.total}, уже не в канале {self.absent}, уведомлено {self.notified}, заблокировали бота {len(self.blocked)}, "
+            f"без уведомления (заблокировали ранее) {len(self.skipped_notify)}, "
+            f"ошибок {self.failed}, "
+            f"{self.elapsed:.1f} с ({self.throughput:.1f} польз./с)"
+        )
+
+
+async def _kick_one(bot: Bot, channel_id: int, user_id: int, in_channel: bool, notify: bool, report: KickReport):
+    if not in_channel:
+        report.absent += 1
+    else:
+        try:
+            await bot.ban_chat_member(chat_id=channel_id, user_id=user_id)
+            await bot.unban_chat_member(chat_id=channel_id, user_id=user_id, only_if_banned=True)
+            report.kicked += 1
+        except Exception as e:
+            report.failed += 1
+            logger.error(f"Не удалось удалить пользователя {user_id} из канала {channel_id}: {e}")
+            return
+    if not notify:
+        report.skipped_notify.append(user_id)
+        return
+    try:
+        await bot.send_message(user_id, EXPIRED_TEXT)
+        report.notified += 1
+    except Exception as e:
+        if is_unreachable(e):
+            report.blocked.append(user_id)
+            return
+        logger.warning(f"Не удалось уведомить пользователя {user_id} об окончании подписки.")
+
+
+async def kick_users(bot: Bot, channel_id: int, user_ids, concurrency: int = 5, blocked=(), absent=()) -> KickReport:
+    """Удаляет пользователей из канала с ограничением параллельности; частоту запросов задает очередь outbox.
+
+    Пользователям из `blocked` (заблокировали бота) уведомление не отправляется, но из канала они удаляются.
+    Пользователи из `absent` уже вышли из канала (по обновлениям chat_member) — запросов на бан для них нет.
+    """
+    report = KickReport(len(user_ids))
+    semaphore = asyncio.Semaphore(concurrency)
+    blocked, absent = set(blocked), set(absent)
+
+    async def worker(user_id):
+        async with semaphore:
+            await _kick_one(bot, channel_id, user_id, user_id not in absent, user_id not in blocked, report)
+
+    with lane(REMINDER):
+        await asyncio.gather(*(worker(user_id) for user_id in user_ids))
+    await known_users.mark_blocked(report.blocked)
+    report.elapsed = time.monotonic() - report.started
+    return report
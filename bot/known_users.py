@@ -0,0 +1,161 @@
+# known_users.py
+import asyncio
+import logging
+import zlib
+from array import array
+from bisect import bisect_left
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+# Сколько новых пользователей копить в множестве, прежде чем слить их в отсортированный массив
+MERGE_THRESHOLD = 5000
+
+
+def _name_hash(username):
+    return zlib.crc32((username or "").encode())
+
+
+def is_unreachable(error) -> bool:
+    """Ошибка означает, что пользователь заблокировал бота или удалил аккаунт — повторять отправку бессмысленно."""
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and "chat not found" in error.message.lower()
+
+
+class KnownUsers:
+    """Множество известных боту пользователей в памяти, чтобы /start не писал в базу каждый раз.
+
+    ID хранятся в отсортированном array('q') (8 байт на пользователя) с параллельным
+    массивом crc32 от username, новые — в небольшом словаре до слияния. Запись в БД идет только
+    для новых пользователей; смена username копится и пишется пачкой раз в `flush_interval` секунд.
+    Здесь же хранится множество заблокировавших бота: повторный /start снимает отметку.
+    """
+
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        self._ids = array('q')
+        self._hashes = array('L')
+        self._recent = {}          # user_id -> crc32(username), еще не слитые в массивы
+        self._pending = {}         # user_id -> username для отложенной записи
+        self._blocked = set()
+        self._task = None
+
+    def __len__(self):
+        return len(self._ids) + len(self._recent)
+
+    async def load(self):
+        ids, hashes = array('q'), array('L')
+        for user_id, username in await db.get_user_names():
+            ids.append(user_id)
+            hashes.append(_name_hash(username))
+        self._ids, self._hashes = ids, hashes
+        self._recent.clear()
+        self._blocked = set(await db.get_blocked_user_ids())
+        logger.info(f"Загружено {len(ids)} известных пользователей, из них заблокировали бота: {len(self._blocked)}.")
+
+    def _find(self, user_id):
+        """Индекс пользователя в отсортированном массиве или -1."""
+        i = bisect_left(self._ids, user_id)
+        return i if i < len(self._ids) and self._ids[i] == user_id else -1
+
+    def _stored_hash(self, user_id):
+        i = self._find(user_id)
+        if i >= 0:
+            return self._hashes[i]
+        return self._recent.get(user_id)
+
+    def _set_hash(self, user_id, name_hash):
+        i = self._find(user_id)
+        if i >= 0:
+            self._hashes[i] = name_hash
+            return
+        self._recent[user_id] = name_hash
+        if len(self._recent) >= MERGE_THRESHOLD:
+            self._merge()
+
+    def _merge(self):
+        # Сортируется только небольшой словарь новых; промежутки между ними копируются срезами массивов,
+        # так что слияние — это копирование памяти без промежуточных Python-объектов на каждого пользователя
+        ids, hashes = array('q'), array('L')
+        start = 0
+        for user_id in sorted(self._recent):
+            i = bisect_left(self._ids, user_id, start)
+            ids += self._ids[start:i]
+            hashes += self._hashes[start:i]
+            ids.append(user_id)
+            hashes.append(self._recent[user_id])
+            start = i
+        ids += self._ids[start:]
+        hashes += self._hashes[start:]
+        self._ids, self._hashes = ids, hashes
+        self._recent.clear()
+
+    async def add(self, user_id, username):
+        """Замена db.add_user: пишет в БД только нового пользователя, смену username откладывает."""
+        if user_id in self._blocked:
+            await db.unblock_user(user_id)
+            self._blocked.discard(user_id)
+        name_hash = _name_hash(username)
+        stored = self._stored_hash(user_id)
+        if stored == name_hash:
+            return
+        if stored is None:
+            await db.add_user(user_id, username)
+            self._pending.pop(user_id, None)
+        else:
+            self._pending[user_id] = username
+            self._ensure_loop()
+        self._set_hash(user_id, name_hash)
+
+    def is_blocked(self, user_id) -> bool:
+        return user_id in self._blocked
+
+    async def mark_blocked(self, user_ids) -> int:
+        """Отмечает пользователей, заблокировавших бота. Возвращает, сколько из них отмечено впервые."""
+        user_ids = [user_id for user_id in user_ids if user_id not in self._blocked]
+        if not user_ids:
+            return 0
+        marked = await db.mark_users_blocked(user_ids)
+        self._blocked.update(user_ids)
+        return marked
+
+    def _ensure_loop(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await db.update_usernames(list(pending.items()))
+        except BaseException:
+            # Не потерять изменения: вернуть их в очередь, не затирая более свежие
+            pending.update(self._pending)
+            self._pending = pending
+            raise
+
+    async def _flush_loop(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить изменения username: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+known_users = KnownUsers()
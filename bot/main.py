@@ -5,86 +5,148 @@ import sys
 
 from aiogram.client.default import DefaultBotProperties
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, DB_READ_CONNECTIONS, DB_PROFILE, DB_SLOW_QUERY_MS, SETTINGS_CACHE_TTL, FSM_STATE_TTL, FSM_CACHE_SIZE,
+    OUTBOX_RATE, KICK_CONCURRENCY, KICK_RATE, BROADCAST_RATE,
+    INVITE_POOL_SIZE, INVITE_LINK_TTL, INVITE_POOL_REFILL_INTERVAL,
+    THROTTLE_USER_LIMIT, THROTTLE_USER_WINDOW, THROTTLE_HANDLER_LIMIT, THROTTLE_HANDLER_WINDOW,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT, TELEGRAM_API_URL,
+    METRICS_HOST, METRICS_PORT,
+)
 # --- ИЗМЕНЕНИЕ ЗДЕСЬ: Импортируем новую функцию из БД ---
-from database import init_db, get_expired_users, get_setting, get_users_nearing_expiry
-from handlers import user_handlers, admin_handlers
+import database as db
+import broadcast
+import dbprofile
+import metrics
+import outbox
+import throttling
+from handlers import user_handlers, admin_handlers, channel_handlers
+from expiry import ExpiryTimeline
+from fsm_storage import SQLiteStorage
+from invites import invite_pool
+from kicker import kick_users
+from known_users import is_unreachable, known_users
+from promos import promo_index
+from tariffs import catalog
+from webhook import run_webhook
 
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
-# ... (функция check_subscriptions для кика остается без изменений) ...
 async def check_subscriptions(bot: Bot):
-    channel_id_str = await get_setting('channel_id')
+    channel_id_str = await db.get_setting('channel_id')
     if not channel_id_str or not channel_id_str.replace('-', '').isdigit():
         logger.warning("Не удалось запустить проверку подписок: ID канала не настроен или некорректен.")
         return
     channel_id = int(channel_id_str)
-    expired_users = await get_expired_users()
+    rows = await db.get_expired_users(channel_id)
+    expired_users = [user_id for user_id, _, _ in rows]
     logger.info(f"Найдено {len(expired_users)} пользователей с истекшей подпиской для кика.")
-    for user in expired_users:
-        user_id = user[0]
-        try:
-            await bot.ban_chat_member(chat_id=channel_id, user_id=user_id)
-            await bot.unban_chat_member(chat_id=channel_id, user_id=user_id, only_if_banned=True)
-            logger.info(f"Пользователь {user_id} был удален из канала {channel_id}.")
-            try:
-                await bot.send_message(user_id, "Срок вашей подписки на канал истёк. Вы можете оформить её заново в меню 'Оплата'.")
-            except Exception:
-                logger.warning(f"Не удалось уведомить пользователя {user_id} об окончании подписки.")
-        except Exception as e:
-            logger.error(f"Не удалось удалить пользователя {user_id} из канала {channel_id}: {e}")
-        await asyncio.sleep(0.5)
+    if not expired_users:
+        return
+    blocked = [user_id for user_id, is_blocked, _ in rows if is_blocked]
+    absent = [user_id for user_id, _, has_left in rows if has_left]
+    report = await kick_users(
+        bot, channel_id, expired_users, concurrency=KICK_CONCURRENCY, blocked=blocked, absent=absent
+    )
+    logger.info(f"Кик из канала {channel_id} завершен: {report}")
 
-# --- НОВАЯ ФУНКЦИЯ: Для отправки напоминаний ---
-async def check_expiring_subscriptions(bot: Bot):
-    """Проверяет и уведомляет пользователей о скором окончании подписки."""
-    logger.info("Запуск проверки подписок, истекающих скоро...")
-    # Напоминание за 3 дня
-    users_3_days = await get_users_nearing_expiry(3)
-    for user in users_3_days:
-        user_id = user[0]
-        try:
-            await bot.send_message(user_id, "🔔 Напоминание: ваша подписка на канал истекает через 3 дня. Не забудьте продлить ее в меню '💳 Оплата', чтобы не потерять доступ!")
-            logger.info(f"Отправлено уведомление за 3 дня пользователю {user_id}")
-        except Exception as e:
-            logger.warning(f"Не удалось отправить уведомление за 3 дня пользователю {user_id}: {e}")
-        await asyncio.sleep(0.2)
-    
-    # Напоминание за 1 день
-    users_1_day = await get_users_nearing_expiry(1)
-    for user in users_1_day:
-        user_id = user[0]
-        try:
-            await bot.send_message(user_id, "‼️ Внимание! Ваша подписка на канал истекает завтра. Продлите ее сейчас, чтобы доступ не прервался.")
-            logger.info(f"Отправлено уведомление за 1 день пользователю {user_id}")
-        except Exception as e:
-            logger.warning(f"Не удалось отправить уведомление за 1 день пользователю {user_id}: {e}")
-        await asyncio.sleep(0.2)
+REMINDER_TEXTS = {
+    3: "🔔 Напоминание: ваша подписка на канал истекает через 3 дня. Не забудьте продлить ее в меню '💳 Оплата', чтобы не потерять доступ!",
+    1: "‼️ Внимание! Ваша подписка на канал истекает завтра. Продлите ее сейчас, чтобы доступ не прервался.",
+}
+
+async def send_expiry_reminder(bot: Bot, user_id: int, days_left: int):
+    """Уведомляет пользователя о скором окончании подписки (вызывается расписанием в нужный момент)."""
+    if known_users.is_blocked(user_id):
+        return
+    try:
+        with outbox.lane(outbox.REMINDER):
+            await bot.send_message(user_id, REMINDER_TEXTS[days_left])
+    except Exception as e:
+        if not is_unreachable(e):
+            raise
+        # Напоминание считается обработанным: повторять его пользователю, заблокировавшему бота, незачем
+        await known_users.mark_blocked([user_id])
+        logger.info(f"Пользователь {user_id} заблокировал бота, напоминание не отправлено.")
+        return
+    logger.info(f"Отправлено уведомление за {days_left} дн. пользователю {user_id}")
 
 async def main():
-    await init_db()
+    # Профилирование подключается до открытия пула, чтобы перехватывать запросы всех соединений
+    if DB_PROFILE:
+        dbprofile.enable(DB_SLOW_QUERY_MS)
+    await db.open_pool(readers=DB_READ_CONNECTIONS)
+    await db.init_db(settings_ttl=SETTINGS_CACHE_TTL)
+    await catalog.load()
+    await promo_index.load()
+    await known_users.load()
 
-    storage = MemoryStorage()
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+    storage = SQLiteStorage(ttl=FSM_STATE_TTL, cache_size=FSM_CACHE_SIZE)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
     dp = Dispatcher(storage=storage)
 
     dp.include_router(user_handlers.router)
     dp.include_router(admin_handlers.router)
+    dp.include_router(channel_handlers.router)
+    # Ограничение частоты подключается раньше метрик: отброшенные апдейты не учитываются ни как апдейты,
+    # ни как вызовы обработчиков, и для них не читается состояние FSM
+    throttling.setup(
+        dp, user_handlers.router, THROTTLE_USER_LIMIT, THROTTLE_USER_WINDOW, THROTTLE_HANDLER_LIMIT, THROTTLE_HANDLER_WINDOW,
+    )
+    # Очередь подключается первой: метрики Bot API тогда измеряют сам запрос, без ожидания в очереди
+    routers = (user_handlers.router, admin_handlers.router, channel_handlers.router)
+    sender = outbox.setup(
+        bot, routers, rate=OUTBOX_RATE,
+        lane_rates={outbox.REMINDER: KICK_RATE, outbox.BROADCAST: BROADCAST_RATE},
+    )
+    metrics.setup(dp, bot, routers)
+    metrics_runner = await metrics.start_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
+    # Кик и напоминания срабатывают точно по времени окончания каждой подписки
+    timeline = ExpiryTimeline(
+        on_expire=lambda: check_subscriptions(bot),
+        on_remind=lambda user_id, days_left: send_expiry_reminder(bot, user_id, days_left),
+    )
+    db.add_subscription_listener(timeline.update)
+    await timeline.load()
+    timeline.start()
 
     scheduler = AsyncIOScheduler(timezone="Europe/Moscow")
-    # Задача для кика (можно запускать чаще, например, раз в час)
-    scheduler.add_job(check_subscriptions, 'interval', hours=1, args=(bot,))
-    # --- ИЗМЕНЕНИЕ ЗДЕСЬ: Добавляем новую задачу для уведомлений (запускаем раз в день) ---
-    scheduler.add_job(check_expiring_subscriptions, 'cron', hour=10, minute=0, args=(bot,)) # Каждый день в 10:00
+    # Страховочная задача на случай ручных правок базы: проверка истекших подписок.
+    # Расписание целиком не перечитывается — оно обновляется при каждом изменении подписки
+    scheduler.add_job(
+        metrics.track_job("check_subscriptions", check_subscriptions), 'cron', hour=4, minute=0, args=(bot,),
+        max_instances=1, coalesce=True,
+    )
     
     scheduler.start()
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    await broadcast.resume_broadcasts(bot)
+    invite_pool.start(bot, size=INVITE_POOL_SIZE, link_ttl=INVITE_LINK_TTL, refill_interval=INVITE_POOL_REFILL_INTERVAL)
+
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(bot, dp, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        scheduler.shutdown(wait=False)
+        await timeline.stop()
+        await broadcast.shutdown()
+        await invite_pool.stop()
+        await known_users.close()
+        await sender.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        dbprofile.log_summary()
+        await db.close_pool()
 
 if __name__ == "__main__":
     try:
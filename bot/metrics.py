@@ -0,0 +1,234 @@
+# metrics.py
+import logging
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._values.items()):
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # счетчики по корзинам (последняя — +Inf), сумма и количество
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def _samples(self, key, state):
+        counts, total, count = state
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+            cumulative += bucket_count
+            le = (("le", bound),)
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- МЕТРИКИ БОТА ---
+
+updates_total = Counter("bot_updates_total", "Обновления от Telegram по типу и результату обработки.", ("type", "result"))
+updates_in_flight = Gauge("bot_updates_in_flight", "Обновления, которые обрабатываются прямо сейчас.")
+update_duration = Histogram("bot_update_duration_seconds", "Полное время обработки обновления, с.", ("type",))
+handler_duration = Histogram("bot_handler_duration_seconds", "Время работы обработчика, с.", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Необработанные исключения в обработчиках.", ("handler", "error"))
+
+api_duration = Histogram("bot_api_request_duration_seconds", "Время запроса к Bot API, с.", ("method",))
+api_errors = Counter("bot_api_errors_total", "Ошибки запросов к Bot API.", ("method", "error"))
+
+outbox_queue_depth = Gauge("bot_outbox_queue_depth", "Запросы к Bot API, ожидающие слота отправки, по полосам.", ("lane",))
+outbox_wait = Histogram("bot_outbox_wait_seconds", "Время ожидания слота отправки, с.", ("lane",))
+outbox_retry_after = Counter("bot_outbox_retry_after_total", "Ответы RetryAfter от Telegram по полосам.", ("lane",))
+
+throttled_updates = Counter("bot_throttled_updates_total", "Апдейты, отброшенные ограничением частоты.", ("scope",))
+
+invite_links = Counter(
+    "bot_invite_links_total", "Выданные ссылки в канал: из пула (pool) или созданные при оплате (created).", ("source",)
+)
+invite_pool_size = Gauge("bot_invite_pool_size", "Свободные ссылки в пуле.")
+
+channel_events = Counter(
+    "bot_channel_member_events_total", "События участников канала из обновлений chat_member и chat_join_request.", ("event",)
+)
+
+job_runs = Counter("bot_job_runs_total", "Запуски фоновых задач по результату.", ("job", "result"))
+job_duration = Histogram("bot_job_duration_seconds", "Длительность фоновой задачи, с.", ("job",))
+job_running = Gauge("bot_job_running", "1, пока задача выполняется.", ("job",))
+job_last_success = Gauge("bot_job_last_success_timestamp_seconds", "Время последнего успешного завершения задачи (unix).", ("job",))
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware диспетчера: число обновлений по типу, обновления в работе, ошибки и общее время."""
+
+    async def __call__(self, handler, event, data):
+        event_type = event.event_type
+        updates_in_flight.inc()
+        started = time.perf_counter()
+        result = "error"
+        try:
+            response = await handler(event, data)
+            result = "unhandled" if response is UNHANDLED else "handled"
+            return response
+        finally:
+            update_duration.observe(time.perf_counter() - started, type=event_type)
+            updates_total.inc(type=event_type, result=result)
+            updates_in_flight.dec()
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Middleware роутера: гистограмма времени и ошибки отдельно по каждому обработчику."""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            handler_errors.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, handler=name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время и ошибки каждого вызова Bot API по имени метода."""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            api_errors.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            api_duration.observe(time.perf_counter() - started, method=name)
+
+
+def setup(dp, bot, routers):
+    """Подключает сбор метрик к диспетчеру, обработчикам роутеров и сессии бота."""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    handler_middleware = HandlerMetricsMiddleware()
+    for router in routers:
+        for name, observer in router.observers.items():
+            if name not in ("update", "error"):
+                observer.middleware(handler_middleware)
+    bot.session.middleware(ApiMetricsMiddleware())
+
+
+def track_job(name, func):
+    """Оборачивает корутину фоновой задачи планировщика в сбор метрик."""
+    async def wrapper(*args, **kwargs):
+        job_running.set(1, job=name)
+        started = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception:
+            job_runs.inc(job=name, result="error")
+            raise
+        else:
+            job_runs.inc(job=name, result="success")
+            job_last_success.set(time.time(), job=name)
+            return result
+        finally:
+            job_duration.observe(time.perf_counter() - started, job=name)
+            job_running.set(0, job=name)
+    wrapper.__name__ = getattr(func, "__name__", name)
+    return wrapper
+
+
+async def _metrics_handler(request):
+    return web.Response(body=render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    """Запускает HTTP-сервер с эндпоинтом /metrics для Prometheus."""
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,128 @@
+# migrate.py
+"""Состояние и пробный прогон миграций схемы базы.
+
+Запуск из папки бота:
+    python migrate.py            — текущая версия схемы, ожидающие миграции и незавершенные заполнения
+    python migrate.py --dry-run  — прогон ожидающих миграций и заполнений на копии базы: сколько строк
+                                   затронет каждый шаг и сколько он займет; рабочая база не меняется
+    python migrate.py --apply    — применить миграции и довести заполнения до конца без запуска бота
+
+Обычно отдельный запуск не нужен: бот применяет миграции при старте, а заполнения идут в фоне.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import database as db
+import migrations
+
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+
+def _copy_database(path, target):
+    """Согласованная копия базы через backup API — можно снимать и с работающего бота."""
+    source = sqlite3.connect(path)
+    copy = sqlite3.connect(target)
+    with copy:
+        source.backup(copy)
+    copy.close()
+    source.close()
+
+
+def status(path):
+    # Только чтение: проверка состояния не должна создавать таблицы или менять режим журнала рабочей базы
+    conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "schema_version" not in tables:
+            print("Таблицы schema_version нет: миграции к этой базе еще не применялись.")
+            version = 0
+        else:
+            version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+        backfills = []
+        if "schema_backfills" in tables:
+            backfills = conn.execute(
+                "SELECT name, cursor, target FROM schema_backfills WHERE finished_at IS NULL ORDER BY name"
+            ).fetchall()
+    finally:
+        conn.close()
+    pending = [m for m in migrations.MIGRATIONS if m.version > version]
+    print(f"Версия схемы: {version} из {migrations.MIGRATIONS[-1].version}")
+    for migration in pending:
+        print(f"  ожидает: {migration.version} «{migration.name}»")
+    for name, cursor, target in backfills:
+        print(f"  заполнение {name}: курсор {cursor} из {target}")
+    if not pending and not backfills:
+        print("Схема актуальна.")
+
+
+async def dry_run(path):
+    with tempfile.TemporaryDirectory() as tmp:
+        copy_path = os.path.join(tmp, "dry_run.db")
+        started = time.perf_counter()
+        _copy_database(path, copy_path)
+        print(f"Копия базы снята за {time.perf_counter() - started:.1f} с.")
+
+        await db.open_pool(copy_path, readers=1)
+        try:
+            async with db._write() as conn:
+                applied = await migrations.migrate(conn)
+            report = await migrations.run_backfills(db._write, pause=0)
+            # Миграции, отложенные до окончания заполнений
+            async with db._write() as conn:
+                applied += await migrations.migrate(conn)
+        finally:
+            await db.close_pool()
+
+    if not applied and not report:
+        print("Ожидающих миграций и заполнений нет.")
+        return
+    # Миграции выполняются при старте бота и держат соединение на запись все это время
+    for version, name, rows, seconds in applied:
+        print(f"Миграция {version} «{name}»: {rows} строк, {seconds:.2f} с (бот не обрабатывает записи)")
+    # Заполнения идут в фоне; к их времени добавляются паузы между порциями
+    for name, (rows, seconds, batches) in report.items():
+        online = seconds + batches * migrations.BACKFILL_PAUSE
+        print(f"Заполнение {name}: {rows} строк, {batches} порций, ~{online:.1f} с в фоне")
+
+
+async def apply(path):
+    await db.open_pool(path, readers=1)
+    try:
+        async with db._write() as conn:
+            await migrations.migrate(conn)
+        await migrations.run_backfills(db._write)
+        async with db._write() as conn:
+            await migrations.migrate(conn)
+    finally:
+        await db.close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы базы бота.")
+    parser.add_argument("--db", default=db.DB_NAME, help="путь к базе")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--dry-run", action="store_true", help="прогнать миграции на копии базы и оценить объем")
+    mode.add_argument("--apply", action="store_true", help="применить миграции и заполнения")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"База {args.db} не найдена.")
+        return
+    if args.dry_run:
+        asyncio.run(dry_run(args.db))
+    elif args.apply:
+        asyncio.run(apply(args.db))
+    else:
+        status(args.db)
+
+
+if __name__ == "__main__":
+    main()
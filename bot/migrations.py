@@ -0,0 +1,581 @@
+# migrations.py
+"""Версионированные миграции схемы базы.
+
+Каждая миграция — пронумерованный шаг, который выполняется один раз в своей транзакции
+и записывается в schema_version. Шаги идемпотентны (IF NOT EXISTS, проверка колонок),
+поэтому базы старых версий бота без schema_version проходят их без ошибок.
+
+Тяжелые заполнения данных (backfill) не выполняются внутри миграции: миграция только
+регистрирует заполнение в schema_backfills, а само оно идет в фоне небольшими порциями,
+каждая в своей короткой транзакции, пока бот продолжает принимать платежи. Заполнения
+пишутся под актуальную схему — они запускаются после применения всех миграций.
+Миграция, которой нужны результаты заполнения, откладывается до его окончания
+(after_backfills) и применяется сразу после него; следующие за ней ждут вместе с ней.
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 2000
+BACKFILL_PAUSE = 0.05
+
+_backfill_task = None
+
+
+class Backfill:
+    """Порционное заполнение с курсором по возрастающему ключу.
+
+    `prepare(db)` вызывается внутри миграции и возвращает (cursor, target) или None, если заполнять нечего;
+    `step(db, cursor, target, limit)` обрабатывает следующую порцию и возвращает (новый курсор, число
+    обработанных строк); курсор None или >= target означает, что заполнение завершено.
+    """
+
+    def __init__(self, name, prepare, step, batch_size=BACKFILL_BATCH_SIZE):
+        self.name = name
+        self.prepare = prepare
+        self.step = step
+        self.batch_size = batch_size
+
+
+class Migration:
+    def __init__(self, version, name, apply, backfills=(), after_backfills=()):
+        self.version = version
+        self.name = name
+        self.apply = apply
+        self.backfills = backfills
+        self.after_backfills = after_backfills
+
+
+async def ensure_column(db, table, column, declaration):
+    """Добавляет колонку в существующую таблицу, если ее еще нет."""
+    columns = [row[1] for row in await db.execute_fetchall(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+async def _column_type(db, table, column):
+    columns = {row[1]: row[2] for row in await db.execute_fetchall(f"PRAGMA table_info({table})")}
+    return columns.get(column)
+
+
+def epoch_date(column, legacy=False):
+    """SQL-выражение даты `column` в unix-секундах.
+
+    legacy — строка еще может хранить дату только в старой строковой колонке `column`_text
+    (местное время), пока ее не перевело заполнение миграции 6.
+    """
+    if not legacy:
+        return column
+    return f"coalesce({column}, CAST(strftime('%s', {column}_text, 'utc') AS INTEGER))"
+
+
+async def _payment_date(db):
+    return epoch_date('payment_date', await _column_type(db, 'payments', 'payment_date_text') is not None)
+
+
+# --- ШАГИ МИГРАЦИЙ ---
+
+async def _initial_schema(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            subscription_end_date TEXT
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS tariffs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            duration_days INTEGER NOT NULL
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            tariff_name TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            duration_days INTEGER NOT NULL,
+            payment_date TEXT NOT NULL,
+            telegram_payment_id TEXT UNIQUE NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(user_id)
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS promo_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code_text TEXT UNIQUE NOT NULL,
+            discount_percent INTEGER NOT NULL,
+            max_uses INTEGER NOT NULL,
+            uses_count INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1
+        )
+    ''')
+
+
+async def _reminder_sent(db):
+    # Наименьший порог напоминания (в днях), уже отправленный за текущий период подписки
+    await ensure_column(db, 'users', 'reminder_sent', 'INTEGER')
+
+
+async def _broadcasts(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_chat_id INTEGER NOT NULL,
+            status_message_id INTEGER,
+            text TEXT,
+            photo_id TEXT,
+            total INTEGER NOT NULL DEFAULT 0,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'running',
+            created_at TEXT NOT NULL
+        )
+    ''')
+
+
+async def _fsm_states(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at)")
+
+
+async def _sales_rollups(db):
+    # Предрасчитанная выручка по дням и по тарифам, обновляется вместе с каждой записью в payments
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            day TEXT PRIMARY KEY,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            sales INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS sales_by_tariff (
+            tariff_name TEXT PRIMARY KEY,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            sales INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+async def _prepare_sales_rollups(db):
+    # Сводки уже заполнены (база старой версии без schema_version) — повторный проход удвоил бы выручку
+    if (await db.execute_fetchall("SELECT EXISTS(SELECT 1 FROM sales_daily)"))[0][0]:
+        return None
+    # Новые платежи сами попадают в сводки, поэтому заполняем только то, что было до миграции
+    target = (await db.execute_fetchall("SELECT MAX(id) FROM payments"))[0][0]
+    return (0, target) if target else None
+
+
+async def _backfill_sales_rollups(db, cursor, target, limit):
+    last, count = (await db.execute_fetchall(
+        "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM payments WHERE id > ? AND id <= ? ORDER BY id LIMIT ?)",
+        (cursor, target, limit)
+    ))[0]
+    if last is None:
+        return None, 0
+    await db.execute(
+        "INSERT INTO sales_daily (day, revenue, sales) "
+        f"SELECT date({await _payment_date(db)}, 'unixepoch', 'localtime') AS day, SUM(price), COUNT(*) FROM payments "
+        "WHERE id > ? AND id <= ? GROUP BY day "
+        "ON CONFLICT(day) DO UPDATE SET revenue = revenue + excluded.revenue, sales = sales + excluded.sales",
+        (cursor, last)
+    )
+    await db.execute(
+        "INSERT INTO sales_by_tariff (tariff_name, revenue, sales) "
+        "SELECT tariff_name, SUM(price), COUNT(*) FROM payments WHERE id > ? AND id <= ? GROUP BY tariff_name "
+        "ON CONFLICT(tariff_name) DO UPDATE SET revenue = revenue + excluded.revenue, sales = sales + excluded.sales",
+        (cursor, last)
+    )
+    return last, count
+
+
+async def _epoch_dates(db):
+    """Переводит даты из строк "%Y-%m-%d %H:%M:%S" (местное время) в unix-секунды.
+
+    У колонки, объявленной как TEXT, SQLite превращает числа обратно в строки, поэтому нужна новая
+    колонка INTEGER. Старая колонка переименовывается в *_text (меняется только схема), новая
+    получает ее имя, а сами даты переводит фоновое заполнение. Пока оно идет, запросы читают
+    дату через epoch_date(), а триггер стирает старую дату подписки, когда бот записывает новую:
+    иначе обнуленная подписка снова читалась бы из старой колонки. Старые колонки удаляет миграция 13.
+    """
+    if await _column_type(db, 'users', 'subscription_end_date') == 'TEXT':
+        await db.execute("ALTER TABLE users RENAME COLUMN subscription_end_date TO subscription_end_date_text")
+        await db.execute("ALTER TABLE users ADD COLUMN subscription_end_date INTEGER")
+        await db.execute('''
+            CREATE TRIGGER IF NOT EXISTS users_subscription_end_date_text
+            AFTER UPDATE OF subscription_end_date ON users WHEN OLD.subscription_end_date_text IS NOT NULL
+            BEGIN
+                UPDATE users SET subscription_end_date_text = NULL WHERE user_id = NEW.user_id;
+            END
+        ''')
+
+    if await _column_type(db, 'payments', 'payment_date') == 'TEXT':
+        await db.execute("ALTER TABLE payments RENAME COLUMN payment_date TO payment_date_text")
+        await db.execute("ALTER TABLE payments ADD COLUMN payment_date INTEGER")
+
+
+def _epoch_backfill(table, key, column):
+    """Заполнение `column` из строковой `column`_text по возрастанию первичного ключа `key`."""
+
+    async def prepare(db):
+        if await _column_type(db, table, f"{column}_text") is None:
+            return None
+        target = (await db.execute_fetchall(f"SELECT MAX({key}) FROM {table}"))[0][0]
+        return (0, target) if target else None
+
+    async def step(db, cursor, target, limit):
+        last, count = (await db.execute_fetchall(
+            f"SELECT MAX({key}), COUNT(*) FROM (SELECT {key} FROM {table} WHERE {key} > ? AND {key} <= ? "
+            f"ORDER BY {key} LIMIT ?)",
+            (cursor, target, limit)
+        ))[0]
+        if last is None:
+            return None, 0
+        # Дату, которую бот уже записал в новую колонку во время заполнения, не трогаем
+        await db.execute(
+            f"UPDATE {table} SET {column} = {epoch_date(column, legacy=True)} "
+            f"WHERE {key} > ? AND {key} <= ? AND {column} IS NULL AND {column}_text IS NOT NULL",
+            (cursor, last)
+        )
+        return last, count
+
+    return Backfill(f"epoch_{column}", prepare, step)
+
+
+EPOCH_BACKFILLS = (
+    _epoch_backfill('users', 'user_id', 'subscription_end_date'),
+    _epoch_backfill('payments', 'id', 'payment_date'),
+)
+
+
+async def _drop_legacy_dates(db):
+    # Все даты уже в колонках INTEGER. DROP COLUMN переписывает строки таблицы, но без разбора дат
+    # и без перестроения индексов; у базы, переведенной прежней версией миграции 6, колонок *_text нет
+    await db.execute("DROP TRIGGER IF EXISTS users_subscription_end_date_text")
+    if await _column_type(db, 'users', 'subscription_end_date_text'):
+        await db.execute("ALTER TABLE users DROP COLUMN subscription_end_date_text")
+    if await _column_type(db, 'payments', 'payment_date_text'):
+        await db.execute("ALTER TABLE payments DROP COLUMN payment_date_text")
+
+
+async def _range_indexes(db):
+    # Диапазонные запросы по окончанию подписки и по дате платежа идут по индексам;
+    # индекс платежей покрывающий — сумма выручки за период не обращается к самой таблице
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_subscription_end ON users(subscription_end_date)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_payments_date ON payments(payment_date, tariff_name, price)")
+
+
+async def _blocked_users(db):
+    # Когда пользователь заблокировал бота (или удалил аккаунт); NULL — пишем ему как обычно
+    await ensure_column(db, 'users', 'blocked_at', 'INTEGER')
+    # В рассылке: сколько пропущено как заблокировавших ранее и сколько заблокировали бота по ходу
+    await ensure_column(db, 'broadcasts', 'skipped', 'INTEGER NOT NULL DEFAULT 0')
+    await ensure_column(db, 'broadcasts', 'blocked', 'INTEGER NOT NULL DEFAULT 0')
+
+
+async def _invite_links(db):
+    # Заранее созданные одноразовые ссылки в канал; claimed_by — кому выдана (NULL — свободна)
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS invite_links (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id INTEGER NOT NULL,
+            invite_link TEXT NOT NULL UNIQUE,
+            expire_date INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            claimed_by INTEGER,
+            claimed_at INTEGER
+        )
+    ''')
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_invite_links_free ON invite_links(channel_id, expire_date) WHERE claimed_by IS NULL"
+    )
+
+
+async def _channel_members(db):
+    # Участие в канале по обновлениям chat_member: кто вступил, по какой ссылке, кто вышел.
+    # flagged_at — вступил без активной подписки
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS channel_members (
+            channel_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            is_member INTEGER NOT NULL,
+            joined_at INTEGER,
+            left_at INTEGER,
+            invite_link TEXT,
+            flagged_at INTEGER,
+            PRIMARY KEY (channel_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    await ensure_column(db, 'invite_links', 'used_by', 'INTEGER')
+    await ensure_column(db, 'invite_links', 'used_at', 'INTEGER')
+
+
+async def _tickets(db):
+    # Вопросы в поддержку и сообщения, которыми они разосланы админам: ответ админа находит тикет
+    # по (чат админа, message_id) через первичный ключ, без разбора текста
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            question TEXT,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_at INTEGER NOT NULL,
+            answered_at INTEGER,
+            answered_by INTEGER
+        )
+    ''')
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tickets_open ON tickets(id) WHERE status = 'open'")
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS ticket_messages (
+            admin_chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            ticket_id INTEGER NOT NULL,
+            PRIMARY KEY (admin_chat_id, message_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+async def _user_browser(db):
+    # Когда пользователь впервые оплатил подписку (NULL — не платил); пишется вместе с платежом
+    await ensure_column(db, 'users', 'first_paid_at', 'INTEGER')
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(user_id, payment_date)")
+    # Индексы списка пользователей в админке: поиск по началу username без учета регистра
+    # и частичные индексы по user_id для каждого фильтра — страница читает только свои строки
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username COLLATE NOCASE)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_blocked ON users(user_id) WHERE blocked_at IS NOT NULL")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_never_paid ON users(user_id) WHERE first_paid_at IS NULL")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_lapsed ON users(user_id) "
+        "WHERE first_paid_at IS NOT NULL AND subscription_end_date IS NULL"
+    )
+
+
+async def _prepare_first_paid_at(db):
+    if not (await db.execute_fetchall("SELECT EXISTS(SELECT 1 FROM payments)"))[0][0]:
+        return None
+    target = (await db.execute_fetchall("SELECT MAX(user_id) FROM users"))[0][0]
+    return (0, target) if target else None
+
+
+async def _backfill_first_paid_at(db, cursor, target, limit):
+    last, count = (await db.execute_fetchall(
+        "SELECT MAX(user_id), COUNT(*) FROM (SELECT user_id FROM users WHERE user_id > ? AND user_id <= ? "
+        "ORDER BY user_id LIMIT ?)",
+        (cursor, target, limit)
+    ))[0]
+    if last is None:
+        return None, 0
+    # MIN по всем платежам: оплата во время заполнения уже записала first_paid_at, но более ранний платеж важнее
+    await db.execute(
+        f"UPDATE users SET first_paid_at = (SELECT MIN({await _payment_date(db)}) FROM payments p WHERE p.user_id = users.user_id) "
+        "WHERE user_id > ? AND user_id <= ? AND EXISTS (SELECT 1 FROM payments p WHERE p.user_id = users.user_id)",
+        (cursor, last)
+    )
+    return last, count
+
+
+MIGRATIONS = [
+    Migration(1, "initial schema", _initial_schema),
+    Migration(2, "users.reminder_sent", _reminder_sent),
+    Migration(3, "broadcasts", _broadcasts),
+    Migration(4, "fsm_states", _fsm_states),
+    Migration(5, "sales rollups", _sales_rollups,
+              backfills=[Backfill("sales_rollups", _prepare_sales_rollups, _backfill_sales_rollups)]),
+    Migration(6, "epoch dates", _epoch_dates, backfills=EPOCH_BACKFILLS),
+    Migration(7, "range indexes", _range_indexes),
+    Migration(8, "blocked users", _blocked_users),
+    Migration(9, "invite links", _invite_links),
+    Migration(10, "channel members", _channel_members),
+    Migration(11, "tickets", _tickets),
+    Migration(12, "user browser", _user_browser,
+              backfills=[Backfill("first_paid_at", _prepare_first_paid_at, _backfill_first_paid_at)]),
+    Migration(13, "drop legacy dates", _drop_legacy_dates,
+              after_backfills=[backfill.name for backfill in EPOCH_BACKFILLS]),
+]
+BACKFILLS = {backfill.name: backfill for m in MIGRATIONS for backfill in m.backfills}
+
+
+# --- ПРИМЕНЕНИЕ ---
+
+async def _ensure_tables(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_backfills (
+            name TEXT PRIMARY KEY,
+            cursor INTEGER NOT NULL,
+            target INTEGER NOT NULL,
+            finished_at INTEGER
+        )
+    ''')
+    await db.commit()
+
+
+async def current_version(db):
+    await _ensure_tables(db)
+    return (await db.execute_fetchall("SELECT COALESCE(MAX(version), 0) FROM schema_version"))[0][0]
+
+
+async def pending_migrations(db):
+    version = await current_version(db)
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+async def _unfinished(db, names):
+    if not names:
+        return False
+    placeholders = ", ".join("?" * len(names))
+    return (await db.execute_fetchall(
+        f"SELECT EXISTS(SELECT 1 FROM schema_backfills WHERE finished_at IS NULL AND name IN ({placeholders}))",
+        list(names)
+    ))[0][0]
+
+
+async def epoch_dates_pending(db):
+    """Идет ли еще перевод строковых дат старой базы в unix-секунды (заполнения миграции 6)."""
+    return await _unfinished(db, [backfill.name for backfill in EPOCH_BACKFILLS])
+
+
+async def migrate(db):
+    """Применяет недостающие миграции, каждую в отдельной транзакции.
+
+    Миграция, чьи заполнения after_backfills еще идут, и все следующие за ней откладываются
+    до следующего вызова (его делает фоновый запуск заполнений по их окончании).
+    Возвращает список (version, name, rows, seconds) примененных шагов, где rows — число измененных строк.
+    """
+    applied = []
+    for migration in await pending_migrations(db):
+        if await _unfinished(db, migration.after_backfills):
+            logger.info(f"Миграция {migration.version} «{migration.name}» отложена до окончания заполнений.")
+            break
+        started = time.perf_counter()
+        changes = db.total_changes
+        if not db.in_transaction:
+            await db.execute("BEGIN")
+        try:
+            await migration.apply(db)
+            rows = db.total_changes - changes
+            for backfill in migration.backfills:
+                state = await backfill.prepare(db)
+                if state:
+                    await db.execute(
+                        "INSERT OR REPLACE INTO schema_backfills (name, cursor, target) VALUES (?, ?, ?)",
+                        (backfill.name, *state)
+                    )
+            await db.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (migration.version, migration.name, int(time.time()))
+            )
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+        seconds = time.perf_counter() - started
+        applied.append((migration.version, migration.name, rows, seconds))
+        logger.info(f"Применена миграция {migration.version} «{migration.name}» за {seconds:.2f} с.")
+    return applied
+
+
+async def unfinished_backfills(db):
+    """Незавершенные заполнения: (name, cursor, target)."""
+    await _ensure_tables(db)
+    return await db.execute_fetchall(
+        "SELECT name, cursor, target FROM schema_backfills WHERE finished_at IS NULL ORDER BY name"
+    )
+
+
+async def run_backfills(write, pause=BACKFILL_PAUSE):
+    """Выполняет все незавершенные заполнения порциями. `write` — db._write() пула соединений.
+
+    Состояние перечитывается в начале каждой порции, поэтому заполнение можно прервать
+    в любой момент (или закрыть вручную) и оно продолжится с места остановки.
+    Возвращает {name: (rows, seconds, batches)}.
+    """
+    async with write() as db:
+        names = [row[0] for row in await unfinished_backfills(db)]
+    report = {}
+    for name in names:
+        backfill = BACKFILLS.get(name)
+        if backfill is None:
+            logger.warning(f"Заполнение {name} не найдено среди миграций, пропускаю.")
+            continue
+        started = time.perf_counter()
+        rows = batches = 0
+        while True:
+            async with write() as db:
+                state = await db.execute_fetchall(
+                    "SELECT cursor, target FROM schema_backfills WHERE name = ? AND finished_at IS NULL", (name,)
+                )
+                if not state:
+                    break
+                cursor, target = state[0]
+                new_cursor, processed = await backfill.step(db, cursor, target, backfill.batch_size)
+                done = new_cursor is None or new_cursor >= target
+                await db.execute(
+                    "UPDATE schema_backfills SET cursor = ?, finished_at = ? WHERE name = ?",
+                    (new_cursor if new_cursor is not None else cursor, int(time.time()) if done else None, name)
+                )
+                rows += processed
+            batches += 1
+            if done:
+                break
+            # Между порциями отпускаем соединение на запись, чтобы платежи не ждали
+            await asyncio.sleep(pause)
+        seconds = time.perf_counter() - started
+        report[name] = (rows, seconds, batches)
+        logger.info(f"Заполнение {name} завершено: {rows} строк за {seconds:.1f} с ({batches} порций).")
+    return report
+
+
+def start_backfills(write, on_finished=None):
+    """Запускает незавершенные заполнения в фоне; после них вызывается `on_finished()`."""
+    global _backfill_task
+    if _backfill_task and not _backfill_task.done():
+        return
+    _backfill_task = asyncio.create_task(_run_backfills_safely(write, on_finished))
+
+
+async def _run_backfills_safely(write, on_finished):
+    try:
+        await run_backfills(write)
+        if on_finished:
+            await on_finished()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка фонового заполнения данных (продолжится при следующем запуске): {e}")
+
+
+async def stop_backfills():
+    global _backfill_task
+    if _backfill_task:
+        _backfill_task.cancel()
+        try:
+            await _backfill_task
+        except asyncio.CancelledError:
+            pass
+        _backfill_task = None
@@ -0,0 +1,230 @@
+# outbox.py
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: чем меньше номер, тем раньше запрос получает слот отправки
+PAYMENT, INTERACTIVE, REMINDER, BROADCAST = range(4)
+LANE_NAMES = ("payment", "interactive", "reminder", "broadcast")
+
+# Ответы на callback и pre-checkout обязаны уйти за секунды и в лимит сообщений не входят,
+# служебные методы тоже не ограничиваем
+EXEMPT_METHODS = {
+    "getUpdates", "getMe", "setWebhook", "deleteWebhook", "getWebhookInfo", "logOut", "close",
+    "answerCallbackQuery", "answerPreCheckoutQuery", "answerShippingQuery", "answerInlineQuery",
+}
+# Лимит на чат Telegram считает только для сообщений; бан, ссылки и прочие действия в канале в него не входят
+PER_CHAT_PREFIXES = ("send", "copyMessage", "forwardMessage")
+
+_lane = contextvars.ContextVar("outbox_lane", default=INTERACTIVE)
+
+
+@contextmanager
+def lane(value):
+    """Все запросы к Bot API внутри блока (и в созданных в нем задачах) идут по полосе `value`."""
+    token = _lane.set(value)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class _Waiter:
+    __slots__ = ("chat_id", "future", "queued_at")
+
+    def __init__(self, chat_id, future):
+        self.chat_id = chat_id
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class Outbox(BaseRequestMiddleware):
+    """Единая очередь исходящих запросов к Bot API с приоритетами.
+
+    Подключается к сессии бота, поэтому через нее проходят все вызовы — из обработчиков,
+    рассылок, кика и напоминаний. Запрос ждет слот в своей полосе приоритета; слоты
+    выдаются по общему лимиту `rate`, лимиту полосы (если задан в `lane_rates`) и лимиту
+    на чат. Свободный слот всегда получает самая приоритетная полоса, так что рассылка
+    не задерживает платежи. RetryAfter обрабатывается здесь же: чат и полоса запроса
+    ставятся на паузу, запрос повторяется до `retries` раз.
+    """
+
+    def __init__(self, rate: float = 30, lane_rates: dict = None, private_chat_rate: float = 1.0,
+                 group_chat_rate: float = 20 / 60, retries: int = 3):
+        self.retries = retries
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self._global = TokenBucket(rate)
+        self._lane_buckets = [TokenBucket((lane_rates or {}).get(i, rate)) for i in range(len(LANE_NAMES))]
+        self._queues = [deque() for _ in LANE_NAMES]
+        self._chats = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        if name in EXEMPT_METHODS:
+            return await make_request(bot, method)
+        lane_no = _lane.get()
+        chat_id = getattr(method, "chat_id", None) if name.startswith(PER_CHAT_PREFIXES) else None
+        for attempt in range(self.retries + 1):
+            await self._acquire(lane_no, chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                metrics.outbox_retry_after.inc(lane=LANE_NAMES[lane_no])
+                if attempt == self.retries:
+                    raise
+                logger.warning(
+                    f"Telegram просит подождать {e.retry_after} с ({name}, полоса {LANE_NAMES[lane_no]}), "
+                    f"приостанавливаю полосу."
+                )
+                self._lane_buckets[lane_no].pause(e.retry_after)
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(e.retry_after)
+
+    def depth(self) -> dict:
+        """Число запросов, ожидающих отправки, по полосам."""
+        return {LANE_NAMES[i]: len(queue) for i, queue in enumerate(self._queues)}
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Личный чат — около сообщения в секунду, группы и каналы — 20 в минуту; небольшой запас на ответ из 2–3 сообщений
+            rate = self.private_chat_rate if not isinstance(chat_id, int) or chat_id > 0 else self.group_chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, capacity=3)
+        return bucket
+
+    async def _acquire(self, lane_no, chat_id):
+        waiter = _Waiter(chat_id, asyncio.get_running_loop().create_future())
+        queue = self._queues[lane_no]
+        queue.append(waiter)
+        metrics.outbox_queue_depth.set(len(queue), lane=LANE_NAMES[lane_no])
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # Отмена задачи отменяет и future; если слот не был выдан, запрос больше не ждет в очереди
+            if waiter.future.cancelled():
+                self._discard(lane_no, (waiter,))
+            raise
+        metrics.outbox_wait.observe(time.monotonic() - waiter.queued_at, lane=LANE_NAMES[lane_no])
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._grant()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant(self):
+        """Выдает слоты, пока это возможно. Возвращает, через сколько секунд пробовать снова (None — очередь пуста)."""
+        while True:
+            now = time.monotonic()
+            if not any(self._queues):
+                self._forget_idle_chats()
+                return None
+            delay = self._global.wait_time(now)
+            if delay > 0:
+                return delay
+            picked, retry_in = self._pick(now)
+            if picked is None:
+                return retry_in
+            lane_no, waiter = picked
+            self._queues[lane_no].remove(waiter)
+            metrics.outbox_queue_depth.set(len(self._queues[lane_no]), lane=LANE_NAMES[lane_no])
+            self._global.consume(now)
+            self._lane_buckets[lane_no].consume(now)
+            if waiter.chat_id is not None:
+                self._chat_bucket(waiter.chat_id).consume(now)
+            waiter.future.set_result(None)
+
+    def _pick(self, now):
+        """Первый готовый запрос самой приоритетной полосы; если готовых нет — минимальное время ожидания."""
+        retry_in = None
+        for lane_no, queue in enumerate(self._queues):
+            if not queue:
+                continue
+            delay = self._lane_buckets[lane_no].wait_time(now)
+            if delay > 0:
+                retry_in = delay if retry_in is None else min(retry_in, delay)
+                continue
+            cancelled = []
+            picked = None
+            for waiter in queue:
+                if waiter.future.cancelled():
+                    cancelled.append(waiter)
+                    continue
+                delay = self._chat_bucket(waiter.chat_id).wait_time(now) if waiter.chat_id is not None else 0
+                if delay == 0:
+                    picked = waiter
+                    break
+                retry_in = delay if retry_in is None else min(retry_in, delay)
+            if cancelled:
+                self._discard(lane_no, cancelled)
+            if picked is not None:
+                return (lane_no, picked), None
+        return None, retry_in
+
+    def _discard(self, lane_no, waiters):
+        """Убирает отмененные запросы из очереди полосы (их мог уже убрать _pick)."""
+        queue = self._queues[lane_no]
+        for waiter in waiters:
+            try:
+                queue.remove(waiter)
+            except ValueError:
+                pass
+        metrics.outbox_queue_depth.set(len(queue), lane=LANE_NAMES[lane_no])
+
+    def _forget_idle_chats(self):
+        if len(self._chats) > 10000:
+            self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.idle}
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class LaneMiddleware(BaseMiddleware):
+    """Middleware роутера: запросы обработчика идут по полосе из флага `lane` (по умолчанию INTERACTIVE)."""
+
+    async def __call__(self, handler, event, data):
+        value = get_flag(data, "lane")
+        if value is None:
+            return await handler(event, data)
+        with lane(value):
+            return await handler(event, data)
+
+
+def setup(bot, routers, rate: float, lane_rates: dict = None, **options) -> Outbox:
+    """Подключает очередь к сессии бота и флаги полос к обработчикам роутеров."""
+    outbox = Outbox(rate=rate, lane_rates=lane_rates, **options)
+    bot.session.middleware(outbox)
+    lane_middleware = LaneMiddleware()
+    for router in routers:
+        for name, observer in router.observers.items():
+            if name not in ("update", "error"):
+                observer.middleware(lane_middleware)
+    return outbox
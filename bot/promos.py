@@ -0,0 +1,135 @@
+# promos.py
+import heapq
+import secrets
+import time
+
+import database as db
+
+RESERVATION_TTL = 15 * 60
+
+
+class Promo:
+    __slots__ = ("id", "code", "discount", "max_uses", "uses_count", "is_active", "reserved")
+
+    def __init__(self, promo_id, code, discount, uses_count, max_uses, is_active):
+        self.id = promo_id
+        self.code = code
+        self.discount = discount
+        self.uses_count = uses_count
+        self.max_uses = max_uses
+        self.is_active = bool(is_active)
+        self.reserved = 0
+
+    @property
+    def available(self) -> int:
+        return self.max_uses - self.uses_count - self.reserved
+
+
+class PromoIndex:
+    """Промокоды в памяти с резервированием использований.
+
+    Использование резервируется при выставлении счета, подтверждается на pre-checkout и
+    списывается после оплаты (счетчик в БД растет в той же транзакции, что и платеж).
+    Неоплаченные резервы истекают через RESERVATION_TTL. Лимит считается как
+    использовано + зарезервировано, поэтому одновременные покупатели не могут выйти за max_uses.
+    Все операции синхронные, так что внутри одного event loop они атомарны.
+    """
+
+    def __init__(self):
+        self._by_code = {}
+        self._by_id = {}
+        self._reservations = {}  # token -> [code, user_id, expires_at]
+        self._by_user = {}       # (user_id, code) -> token
+        self._expiry = []        # куча (expires_at, token); устаревшие записи пропускаются при разборе
+
+    async def load(self):
+        self._by_code.clear()
+        self._by_id.clear()
+        for row in await db.get_all_promo_codes():
+            self._add(Promo(*row))
+
+    def _add(self, promo: Promo):
+        self._by_code[promo.code] = promo
+        self._by_id[promo.id] = promo
+
+    def rows(self):
+        """Промокоды в формате db.get_all_promo_codes() для клавиатуры админа."""
+        return [(p.id, p.code, p.discount, p.uses_count, p.max_uses, p.is_active) for p in self._by_id.values()]
+
+    def get(self, code):
+        return self._by_code.get(code.upper())
+
+    def is_available(self, code) -> bool:
+        self._purge()
+        promo = self.get(code)
+        return bool(promo and promo.is_active and promo.available > 0)
+
+    def _purge(self):
+        now = time.time()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, token = heapq.heappop(self._expiry)
+            reservation = self._reservations.get(token)
+            if reservation and reservation[2] <= now:
+                self._drop(token)
+
+    def _drop(self, token):
+        code, user_id, _ = self._reservations.pop(token)
+        self._by_user.pop((user_id, code), None)
+        promo = self._by_code.get(code)
+        if promo:
+            promo.reserved -= 1
+
+    def _schedule(self, token, expires_at):
+        self._reservations[token][2] = expires_at
+        heapq.heappush(self._expiry, (expires_at, token))
+
+    def reserve(self, code, user_id, token=None):
+        """Резервирует одно использование промокода за пользователем. Возвращает токен резерва или None."""
+        self._purge()
+        code = code.upper()
+        existing = self._by_user.get((user_id, code))
+        if existing:
+            self._schedule(existing, time.time() + RESERVATION_TTL)
+            return existing
+        promo = self._by_code.get(code)
+        if not promo or not promo.is_active or promo.available <= 0:
+            return None
+        token = token or secrets.token_hex(4)
+        promo.reserved += 1
+        self._reservations[token] = [code, user_id, 0]
+        self._by_user[(user_id, code)] = token
+        self._schedule(token, time.time() + RESERVATION_TTL)
+        return token
+
+    def confirm(self, token, code, user_id) -> bool:
+        """Продлевает резерв на этапе pre-checkout; если резерв потерян (истек, перезапуск) — пытается взять заново."""
+        self._purge()
+        if token in self._reservations:
+            self._schedule(token, time.time() + RESERVATION_TTL)
+            return True
+        return self.reserve(code, user_id, token=token) is not None
+
+    def commit(self, token, code):
+        """Переводит резерв в использование после успешной оплаты."""
+        if token in self._reservations:
+            self._drop(token)
+        promo = self._by_code.get(code.upper())
+        if promo:
+            promo.uses_count += 1
+
+    def release(self, token):
+        if token in self._reservations:
+            self._drop(token)
+
+    async def create(self, code, discount, max_uses):
+        promo_id = await db.create_promo_code(code, discount, max_uses)
+        self._add(Promo(promo_id, code.upper(), discount, 0, max_uses, True))
+
+    async def toggle(self, promo_id):
+        await db.toggle_promo_code_activity(promo_id)
+        promo = self._by_id.get(promo_id)
+        if promo:
+            promo.is_active = not promo.is_active
+
+
+promo_index = PromoIndex()
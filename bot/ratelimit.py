@@ -0,0 +1,50 @@
+# ratelimit.py
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Асинхронный token bucket: не больше `rate` операций в секунду с запасом `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, now: float = None) -> float:
+        """Через сколько секунд будет доступен токен (0 — доступен сейчас)."""
+        now = time.monotonic() if now is None else now
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def consume(self, now: float = None):
+        """Забирает токен; вызывать после wait_time() == 0."""
+        self._refill(time.monotonic() if now is None else now)
+        self._tokens -= 1
+
+    @property
+    def idle(self) -> bool:
+        """Bucket полон и не на паузе — его можно выбросить и создать заново без потери точности."""
+        return self.wait_time() == 0 and self._tokens >= self.capacity
+
+    async def acquire(self):
+        """Ждет, пока появится свободный токен (и закончится пауза после RetryAfter)."""
+        async with self._lock:
+            while (delay := self.wait_time()) > 0:
+                await asyncio.sleep(delay)
+            self.consume()
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов на `seconds` секунд (например, по ответу RetryAfter от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
@@ -0,0 +1,29 @@
+# rebuild_stats.py
+"""Разовый пересчет сводных таблиц статистики по всей истории платежей.
+
+Запуск из папки бота: python rebuild_stats.py
+Можно выполнять и при работающем боте — пересчет идет одной транзакцией.
+"""
+import asyncio
+import logging
+import sys
+
+import database as db
+
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    await db.open_pool(readers=1)
+    try:
+        await db.init_db()
+        await db.rebuild_sales_rollups()
+        total_revenue, total_sales = await db.get_sales_for_period()
+        logger.info(f"Статистика пересчитана: {total_sales} продаж на {total_revenue} RUB.")
+    finally:
+        await db.close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
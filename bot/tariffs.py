@@ -0,0 +1,43 @@
+# tariffs.py
+import database as db
+import keyboards as kb
+
+
+class TariffCatalog:
+    """Тарифы в памяти вместе с готовыми клавиатурами.
+
+    Данные и клавиатуры хранятся одним снимком и заменяются целиком после любого изменения,
+    поэтому воронка оплаты никогда не видит тарифы и кнопки из разных версий и не ходит в БД.
+    """
+
+    def __init__(self):
+        self._snapshot = ({}, kb.get_payment_menu([]), kb.get_manage_tariffs_kb([]))
+
+    async def load(self):
+        """Перечитывает тарифы из БД и пересобирает клавиатуры."""
+        tariffs = await db.get_all_tariffs()
+        by_id = {tariff[0]: (tariff[1], tariff[2], tariff[3]) for tariff in tariffs}
+        self._snapshot = (by_id, kb.get_payment_menu(tariffs), kb.get_manage_tariffs_kb(tariffs))
+
+    def get(self, tariff_id):
+        """Возвращает (name, price, duration_days) или None — как db.get_tariff_details."""
+        return self._snapshot[0].get(tariff_id)
+
+    @property
+    def payment_menu(self):
+        return self._snapshot[1]
+
+    @property
+    def manage_menu(self):
+        return self._snapshot[2]
+
+    async def add(self, name, price, duration):
+        await db.add_tariff(name, price, duration)
+        await self.load()
+
+    async def delete(self, tariff_id):
+        await db.delete_tariff(tariff_id)
+        await self.load()
+
+
+catalog = TariffCatalog()
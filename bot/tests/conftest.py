@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# Модули бота импортируются по короткому имени (import database), как при запуске из папки bot
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,81 @@
+# tests/test_epoch_dates.py
+import asyncio
+import sqlite3
+from datetime import datetime
+
+import database as db
+import migrations
+
+
+def _epoch(text):
+    return int(datetime.strptime(text, "%Y-%m-%d %H:%M:%S").timestamp())
+
+
+def _legacy_database(path):
+    """База старой версии бота: даты строками, без schema_version."""
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, username TEXT, subscription_end_date TEXT, reminder_sent INTEGER);
+        CREATE TABLE payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, tariff_name TEXT NOT NULL,
+            price INTEGER NOT NULL, duration_days INTEGER NOT NULL, payment_date TEXT NOT NULL,
+            telegram_payment_id TEXT UNIQUE NOT NULL
+        );
+    ''')
+    conn.executemany(
+        "INSERT INTO users (user_id, username, subscription_end_date) VALUES (?, ?, ?)",
+        [(1, "active", "2099-01-01 12:00:00"), (2, "revoked", "2099-06-01 12:00:00"), (3, "lapsed", None)]
+    )
+    conn.executemany(
+        "INSERT INTO payments (user_id, tariff_name, price, duration_days, payment_date, telegram_payment_id) "
+        "VALUES (?, 'Месяц', 100, 30, ?, ?)",
+        [(1, "2024-03-01 10:00:00", "a"), (2, "2024-03-02 10:00:00", "b"), (3, "2024-02-01 09:30:00", "c")]
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_dates_are_read_during_backfill_and_swapped_after(tmp_path):
+    path = str(tmp_path / "bot.db")
+    _legacy_database(path)
+
+    async def scenario():
+        await db.open_pool(path, readers=1)
+        try:
+            await db.init_db()
+            # Заполнение еще не шло: даты читаются из старых колонок
+            await migrations.stop_backfills()
+            assert "subscription_end_date_text" in db._subscription_end
+            assert await db.get_user_subscription(1) == _epoch("2099-01-01 12:00:00")
+            await db.revoke_subscription(2)
+            assert await db.get_user_subscription(2) is None
+            assert await db.apply_payment(4, "Месяц", 100, 30, "d") is not None
+            active = [row[0] for row in await db.browse_users('active')]
+            payments = [row for rows in [r async for r in db.iter_payments()] for row in rows]
+
+            await migrations.run_backfills(db._write, pause=0)
+            await db._finish_backfills()
+            expired = [row[0] for row in await db.browse_users('expired')]
+            async with db._read() as conn:
+                version = await migrations.current_version(conn)
+                columns = [row[1] for row in await conn.execute_fetchall("PRAGMA table_info(payments)")]
+                first_paid = await conn.execute_fetchall("SELECT user_id, first_paid_at FROM users ORDER BY user_id")
+            return (
+                active, expired, payments, version, columns, first_paid,
+                await db.get_user_subscription(1), await db.get_user_subscription(2), await db.get_sales_for_period(),
+            )
+        finally:
+            await db.close_pool()
+
+    active, expired, payments, version, columns, first_paid, end_1, end_2, sales = asyncio.run(scenario())
+    assert sorted(active) == [1, 4]
+    assert expired == [2, 3]
+    assert [(row[1], row[6]) for row in payments][:3] == [
+        (3, _epoch("2024-02-01 09:30:00")), (1, _epoch("2024-03-01 10:00:00")), (2, _epoch("2024-03-02 10:00:00"))
+    ]
+    assert version == migrations.MIGRATIONS[-1].version
+    assert "payment_date_text" not in columns
+    assert dict(first_paid)[3] == _epoch("2024-02-01 09:30:00")
+    assert end_1 == _epoch("2099-01-01 12:00:00")
+    assert end_2 is None
+    assert sales == (400, 4)
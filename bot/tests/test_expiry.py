@@ -0,0 +1,50 @@
+# tests/test_expiry.py
+from expiry import KICK, ExpiryTimeline
+
+
+def _kinds(end, now, reminder_sent=None):
+    timeline = ExpiryTimeline(None, None)
+    return [event[4] for event in timeline._events(1, end, reminder_sent, now, catch_up=True)]
+
+
+def test_no_catch_up_reminder_right_before_expiry():
+    now = 1_700_000_000
+    assert _kinds(now + 2, now) == [KICK]
+    assert _kinds(now + 10 * 3600, now) == [KICK]
+
+
+def test_catch_up_sends_most_urgent_missed_reminder():
+    now = 1_700_000_000
+    assert _kinds(now + 13 * 3600, now) == [KICK, 1]
+    assert sorted(_kinds(now + 2 * 86400, now)) == [KICK, 1, 3]
+
+
+def test_update_during_load_is_not_lost(monkeypatch):
+    import asyncio
+    import time
+
+    import expiry
+
+    async def scenario():
+        timeline = ExpiryTimeline(None, None)
+        now = time.time()
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def get_active_subscriptions():
+            started.set()
+            await release.wait()
+            return [(1, now + 86400 * 10, None), (2, now + 86400 * 10, None)]
+
+        monkeypatch.setattr(expiry.db, "get_active_subscriptions", get_active_subscriptions)
+        load = asyncio.create_task(timeline.load())
+        await started.wait()
+        # Оплата и аннулирование, пришедшие, пока запрос к БД еще не вернулся со старым снимком
+        timeline.update(1, now + 86400 * 40)
+        timeline.update(2, None)
+        release.set()
+        await load
+        return timeline._ends, now
+
+    ends, now = asyncio.run(scenario())
+    assert ends == {1: now + 86400 * 40}
@@ -0,0 +1,30 @@
+# tests/test_known_users.py
+import random
+from array import array
+
+import known_users
+from known_users import KnownUsers
+
+
+def test_merge_keeps_ids_sorted_with_their_hashes():
+    users = KnownUsers()
+    existing = sorted(random.Random(1).sample(range(1, 10 ** 9), 10000))
+    users._ids = array('q', existing)
+    users._hashes = array('L', (user_id % 997 for user_id in existing))
+    recent = {user_id: user_id % 997 for user_id in random.Random(2).sample(range(1, 10 ** 9), 3000) if users._find(user_id) < 0}
+    recent[1] = 1                # меньше всех существующих
+    recent[10 ** 9 + 5] = (10 ** 9 + 5) % 997  # больше всех существующих
+    users._recent = dict(recent)
+    users._merge()
+    assert list(users._ids) == sorted(existing + list(recent))
+    assert all(users._hashes[i] == users._ids[i] % 997 for i in range(len(users._ids)))
+    assert not users._recent
+
+
+def test_merge_triggers_at_threshold(monkeypatch):
+    monkeypatch.setattr(known_users, "MERGE_THRESHOLD", 3)
+    users = KnownUsers()
+    for user_id in (30, 10, 20):
+        users._set_hash(user_id, user_id)
+    assert list(users._ids) == [10, 20, 30] and not users._recent
+    assert users._stored_hash(20) == 20
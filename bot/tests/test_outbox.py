@@ -0,0 +1,53 @@
+# tests/test_outbox.py
+import asyncio
+
+from outbox import Outbox
+
+
+class FakeMethod:
+    __api_method__ = "sendMessage"
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+
+
+async def _ok(bot, method):
+    return True
+
+
+def test_cancelled_send_leaves_queue():
+    async def scenario():
+        outbox = Outbox(rate=1)
+        try:
+            # Первый запрос забирает единственный токен, второй остается ждать в очереди
+            assert await outbox(_ok, None, FakeMethod(1))
+            task = asyncio.create_task(outbox(_ok, None, FakeMethod(2)))
+            await asyncio.sleep(0.05)
+            assert outbox.depth()["interactive"] == 1
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            assert outbox.depth()["interactive"] == 0
+        finally:
+            await outbox.close()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiters_are_skipped():
+    async def scenario():
+        outbox = Outbox(rate=20)
+        try:
+            for chat_id in range(20):
+                await outbox(_ok, None, FakeMethod(chat_id))
+            cancelled = [asyncio.create_task(outbox(_ok, None, FakeMethod(100 + i))) for i in range(3)]
+            alive = asyncio.create_task(outbox(_ok, None, FakeMethod(200)))
+            await asyncio.sleep(0)
+            for task in cancelled:
+                task.cancel()
+            assert await asyncio.wait_for(alive, timeout=2)
+            await asyncio.gather(*cancelled, return_exceptions=True)
+            assert outbox.depth()["interactive"] == 0
+        finally:
+            await outbox.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,69 @@
+# tests/test_user_browser.py
+import asyncio
+import sqlite3
+
+import pytest
+
+import database as db
+
+# Индекс, по которому должна читаться страница каждого фильтра (None — по первичному ключу)
+EXPECTED_INDEX = {
+    'all': None,
+    'active': "idx_users_subscription_end",
+    'expired': "idx_users_lapsed",
+    'never_paid': "idx_users_never_paid",
+    'blocked': "idx_users_blocked",
+    'search': "idx_users_username",
+}
+CURSORS = {'search': ("user5", 5), 'active': (1_700_000_000, 5)}
+
+
+@pytest.fixture(scope="module")
+def db_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("db") / "bot.db")
+
+    async def init():
+        await db.open_pool(path, readers=1)
+        try:
+            await db.init_db()
+        finally:
+            await db.close_pool()
+
+    asyncio.run(init())
+    conn = sqlite3.connect(path)
+    # Никогда не плативших больше, чем истекших, — как в реальной базе
+    conn.executemany(
+        "INSERT INTO users (user_id, username, subscription_end_date, first_paid_at, blocked_at) VALUES (?, ?, ?, ?, ?)",
+        [(i, f"user{i}", None if i % 3 else 2_000_000_000, 1_600_000_000 if i % 10 == 0 else None, None) for i in range(1, 2001)]
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.mark.parametrize("filter_name", list(db.USER_FILTERS))
+@pytest.mark.parametrize("page", ["first", "next", "previous"])
+def test_every_filter_reads_its_index(db_path, filter_name, page):
+    cursor = None if page == "first" else CURSORS.get(filter_name, (5, 5))
+    sql, params = db._browse_users_query(filter_name, cursor, page == "previous", 10, "user")
+    conn = sqlite3.connect(db_path)
+    plan = " | ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+    conn.close()
+    assert "TEMP B-TREE" not in plan
+    index = EXPECTED_INDEX[filter_name]
+    if index:
+        assert f"USING INDEX {index}" in plan or f"USING COVERING INDEX {index}" in plan, plan
+    else:
+        assert plan == "SCAN users" or "INTEGER PRIMARY KEY" in plan, plan
+
+
+def test_expired_page_skips_never_paid(db_path):
+    async def scenario():
+        await db.open_pool(db_path, readers=1)
+        try:
+            return await db.browse_users('expired', limit=5)
+        finally:
+            await db.close_pool()
+
+    rows = asyncio.run(scenario())
+    assert [row[0] for row in rows] == [10, 20, 40, 50, 70, 80]
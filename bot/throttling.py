@@ -0,0 +1,144 @@
+# throttling.py
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, Update
+
+import metrics
+from config import ADMIN_IDS
+
+BUSY_TEXT = "⏳ Слишком много запросов. Попробуйте через несколько секунд."
+
+
+class _Window:
+    __slots__ = ("started", "previous", "current", "touched", "warned")
+
+    def __init__(self, now):
+        self.started = now
+        self.previous = 0
+        self.current = 0
+        self.touched = now
+        self.warned = False
+
+
+class SlidingWindowLimiter:
+    """Не больше `limit` событий за `window` секунд на ключ.
+
+    Скользящее окно приближается двумя фиксированными (текущим и предыдущим) — на ключ хранится
+    несколько чисел независимо от частоты событий. Ключи упорядочены по последнему обращению,
+    поэтому простаивающие дольше двух окон вытесняются с начала словаря за O(1) на обращение.
+    """
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._windows = OrderedDict()
+
+    def __len__(self):
+        return len(self._windows)
+
+    def _evict(self, now):
+        idle_since = now - 2 * self.window
+        while self._windows:
+            key, w = next(iter(self._windows.items()))
+            if w.touched >= idle_since:
+                break
+            del self._windows[key]
+
+    def hit(self, key, now=None) -> bool:
+        """Учитывает событие. False — лимит исчерпан, событие не засчитывается."""
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        w = self._windows.get(key)
+        if w is None:
+            w = self._windows[key] = _Window(now)
+        else:
+            self._windows.move_to_end(key)
+            w.touched = now
+            passed = int((now - w.started) // self.window)
+            if passed:
+                w.previous = w.current if passed == 1 else 0
+                w.current = 0
+                w.started += passed * self.window
+        weight = 1 - (now - w.started) / self.window
+        if w.previous * weight + w.current >= self.limit:
+            return False
+        w.current += 1
+        w.warned = False
+        return True
+
+    def warn_once(self, key) -> bool:
+        """True только для первого отброшенного события после последнего пропущенного."""
+        w = self._windows.get(key)
+        if w is None or w.warned:
+            return False
+        w.warned = True
+        return True
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничивает частоту апдейтов от одного пользователя.
+
+    Общий лимит на пользователя (`per_handler=False`) стоит на апдейтах диспетчера перед FSMContextMiddleware,
+    поэтому отброшенный апдейт не доходит ни до фильтров, ни до чтения состояния FSM из хранилища.
+    Ограничиваются только сообщения и callback-запросы. Внутренняя middleware роутера
+    (`per_handler=True`) считает пары (пользователь, обработчик);
+    флаг обработчика `throttle` задает свой лимит `(limit, window)` или `False` — не ограничивать.
+    Отброшенный апдейт не трогает БД: на callback отвечаем всплывающим текстом, на сообщение —
+    одним предупреждением за серию.
+    """
+
+    def __init__(self, limit: int, window: float, per_handler: bool = False):
+        self.per_handler = per_handler
+        self._default = (limit, window)
+        self._limiters = {}
+
+    def _limiter(self, limit, window) -> SlidingWindowLimiter:
+        limiter = self._limiters.get((limit, window))
+        if limiter is None:
+            limiter = self._limiters[(limit, window)] = SlidingWindowLimiter(limit, window)
+        return limiter
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id in ADMIN_IDS:
+            return await handler(event, data)
+        if self.per_handler:
+            flag = get_flag(data, "throttle", default=self._default)
+            if flag is False:
+                return await handler(event, data)
+            key = (user.id, data["handler"].callback.__name__)
+            limiter = self._limiter(*flag)
+            reply_to = event
+        else:
+            reply_to = event.message or event.callback_query if isinstance(event, Update) else None
+            if reply_to is None:
+                return await handler(event, data)
+            # Успешная оплата уже списана с пользователя — ее нельзя отбрасывать ни при каком лимите
+            if isinstance(reply_to, Message) and reply_to.successful_payment:
+                return await handler(event, data)
+            key = user.id
+            limiter = self._limiter(*self._default)
+        if limiter.hit(key):
+            return await handler(event, data)
+
+        metrics.throttled_updates.inc(scope="handler" if self.per_handler else "user")
+        if isinstance(reply_to, CallbackQuery):
+            await reply_to.answer(BUSY_TEXT)
+        elif isinstance(reply_to, Message) and limiter.warn_once(key):
+            await reply_to.answer(BUSY_TEXT)
+        return None
+
+
+def setup(dp, router, user_limit: int, user_window: float, handler_limit: int, handler_window: float):
+    """Подключает общий лимит на пользователя к апдейтам диспетчера и лимит на обработчик — к роутеру."""
+    # Диспетчер регистрирует FSMContextMiddleware в конструкторе; переставляем ее после лимита,
+    # чтобы состояние читалось только для пропущенных апдейтов
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(ThrottlingMiddleware(user_limit, user_window))
+    dp.update.outer_middleware(dp.fsm)
+    per_handler = ThrottlingMiddleware(handler_limit, handler_window, per_handler=True)
+    for observer in (router.message, router.callback_query):
+        observer.middleware(per_handler)
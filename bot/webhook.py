@@ -0,0 +1,37 @@
+# webhook.py
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, url: str, path: str, secret: str, host: str, port: int):
+    """Принимает обновления через вебхук на aiohttp-сервере до отмены задачи.
+
+    Telegram получает ответ сразу, а обновление обрабатывается диспетчером в фоне,
+    поэтому медленный обработчик не задерживает HTTP-ответ и повторную доставку.
+    Запросы без правильного X-Telegram-Bot-Api-Secret-Token отклоняются.
+    """
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret, handle_in_background=True).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    try:
+        await bot.set_webhook(
+            url=f"{url.rstrip('/')}{path}",
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True,
+        )
+        logger.info(f"Вебхук установлен на {url.rstrip('/')}{path}, сервер слушает {host}:{port}.")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()